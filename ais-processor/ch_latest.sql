@@ -0,0 +1,45 @@
+-- latest message per mmsi, kept by ClickHouse itself
+-- ReplacingMergeTree(ts) collapses rows of the same mmsi to the newest ts on merge,
+-- argMax(..., ts) in the ingestor query returns the right row before parts are merged
+
+-- class A position
+CREATE TABLE IF NOT EXISTS pnav.ais_position_latest AS pnav.ais_position
+ENGINE = ReplacingMergeTree(ts)
+ORDER BY mmsi;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS pnav.ais_position_latest_mv TO pnav.ais_position_latest AS
+SELECT * FROM pnav.ais_position;
+
+
+-- class B position
+CREATE TABLE IF NOT EXISTS pnav.ais_type18_latest AS pnav.ais_type18
+ENGINE = ReplacingMergeTree(ts)
+ORDER BY mmsi;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS pnav.ais_type18_latest_mv TO pnav.ais_type18_latest AS
+SELECT * FROM pnav.ais_type18;
+
+
+-- class A static
+CREATE TABLE IF NOT EXISTS pnav.ais_static_latest AS pnav.ais_static
+ENGINE = ReplacingMergeTree(ts)
+ORDER BY mmsi;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS pnav.ais_static_latest_mv TO pnav.ais_static_latest AS
+SELECT * FROM pnav.ais_static;
+
+
+-- class B static
+CREATE TABLE IF NOT EXISTS pnav.ais_type24_latest AS pnav.ais_type24
+ENGINE = ReplacingMergeTree(ts)
+ORDER BY mmsi;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS pnav.ais_type24_latest_mv TO pnav.ais_type24_latest AS
+SELECT * FROM pnav.ais_type24;
+
+
+-- seed with recent history once, the views only see inserts made after their creation
+INSERT INTO pnav.ais_position_latest SELECT * FROM pnav.ais_position WHERE ts >= now() - INTERVAL 5 DAY;
+INSERT INTO pnav.ais_type18_latest SELECT * FROM pnav.ais_type18 WHERE ts >= now() - INTERVAL 5 DAY;
+INSERT INTO pnav.ais_static_latest SELECT * FROM pnav.ais_static WHERE ts >= now() - INTERVAL 5 DAY;
+INSERT INTO pnav.ais_type24_latest SELECT * FROM pnav.ais_type24 WHERE ts >= now() - INTERVAL 5 DAY;
@@ -0,0 +1,106 @@
+# Per-vessel change detection for the latest-state upserts
+#
+# Keeps a content hash of the last row written for each mmsi. Staged rows whose
+# payload (every column but mmsi and ts) hashes the same are dropped before COPY,
+# unless the stored ts is older than `refresh` seconds, so consumers filtering on
+# ts still see moored vessels. The hashes are rebuilt from the target table on
+# start, which is where they are persisted; the ON CONFLICT merge repeats the
+# same test server side with IS DISTINCT FROM. Writers other than the stream
+# (reconciliation) forget() the vessels they wrote, so a payload they replaced
+# is never taken as still stored.
+
+from sqlalchemy import text
+
+import threading
+import logging
+
+
+def naive(ts):
+    return ts.replace(tzinfo=None)
+
+
+class ChangeFilter:
+    def __init__(self, columns, refresh):
+        self.columns = list(columns)
+        self.refresh = refresh
+        self.compare = [c for c in self.columns if c not in ('mmsi', 'ts')]
+
+        self._mmsi = self.columns.index('mmsi')
+        self._ts = self.columns.index('ts')
+        self._payload = [self.columns.index(c) for c in self.compare]
+
+        self._written = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    def digest(self, row):
+        return hash(tuple(row[i] for i in self._payload))
+
+    def load(self, conn, table):
+        cols = ', '.join(f'"{c}"' for c in self.columns)
+
+        for row in conn.execute(text(f'SELECT {cols} FROM {table}')):
+            self._written[row[self._mmsi]] = (self.digest(row), naive(row[self._ts]))
+
+        logging.info(f'Change filter loaded....{table} {len(self._written)} vessels')
+
+    def rows(self, rows):
+        """Yield the rows worth writing, remembering them until commit() or discard()."""
+        for row in rows:
+            mmsi = row[self._mmsi]
+            digest = self.digest(row)
+            written = self._pending.get(mmsi) or self._written.get(mmsi)
+
+            ts = naive(row[self._ts])
+
+            if written is not None and written[0] == digest and (ts - written[1]).total_seconds() < self.refresh:
+                self.skipped += 1
+                continue
+
+            self._pending[mmsi] = (digest, ts)
+            yield row
+
+    def commit(self):
+        with self._lock:
+            self._written.update(self._pending)
+            self._pending.clear()
+
+        if self.skipped:
+            logging.info(f'Change filter skipped....{self.skipped} unchanged rows')
+
+        self.skipped = 0
+
+    def discard(self):
+        with self._lock:
+            self._pending.clear()
+
+        self.skipped = 0
+
+    def forget(self, vessels):
+        """Drop what is known of `vessels`, written by another thread; their next row is always written."""
+        with self._lock:
+            for mmsi in vessels:
+                self._written.pop(mmsi, None)
+                self._pending.pop(mmsi, None)
+
+
+change_filters = {}
+change_filters_lock = threading.Lock()
+
+
+def get_change_filter(source, engine, columns):
+    """ChangeFilter of a source with 'change_refresh' set, loaded from its target table on first use."""
+    if source.get('change_refresh') is None:
+        return None
+
+    with change_filters_lock:
+        if source['name'] not in change_filters:
+            changes = ChangeFilter(columns, source['change_refresh'])
+
+            with engine.connect() as conn:
+                changes.load(conn, source['target'].__tablename__)
+
+            change_filters[source['name']] = changes
+
+    return change_filters[source['name']]
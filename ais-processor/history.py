@@ -0,0 +1,142 @@
+# Append-only position history, range partitioned on ts
+#
+# One partition per day or month, created on demand for the windows being written
+# and dropped once past retention. Partitions carry a BRIN index on ts (cheap to
+# maintain on append-only data) and a unique (mmsi, ts) index so replayed windows
+# are ignored instead of duplicated.
+#
+# Partitions are created and dropped inside the window transaction, so what was
+# done is only remembered once the caller reports the commit: commit_partitions()
+# after it, discard_partitions() after a rollback.
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError, ProgrammingError
+
+import time
+import logging
+import psycopg2.errors
+
+
+# partitions already known to exist (committed), per history table
+known_partitions = {}
+
+# partitions created by the open window transaction, per history table
+created_partitions = {}
+
+# last committed retention sweep per history table, and the one in the open transaction
+last_sweep = {}
+pending_sweep = {}
+
+SWEEP_INTERVAL = 3600  # seconds
+
+
+def partition_bounds(ts, granularity):
+    if granularity == 'month':
+        start = datetime(ts.year, ts.month, 1)
+        end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+        return start, end, f'{start:%Y%m}'
+
+    start = datetime(ts.year, ts.month, ts.day)
+    return start, start + timedelta(days=1), f'{start:%Y%m%d}'
+
+
+def create_history_table(conn, history, target, columns):
+    """Create the partitioned parent with the type of each column in the latest-state target."""
+    dialect = postgresql.dialect()
+    table = history['table']
+    types = {c.name: c.type.compile(dialect=dialect) for c in target.__table__.columns}
+    definition = ', '.join(f'"{col}" {types[col]}' for col in columns)
+
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS {table} ({definition}) PARTITION BY RANGE (ts)'))
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_ts ON {table} USING brin (ts)'))
+    conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_mmsi_ts ON {table} (mmsi, ts)'))
+
+
+def create_partition(conn, table, suffix, start, end):
+    # IF NOT EXISTS does not cover a writer creating the same partition concurrently,
+    # the loser gets a catalog unique violation once the winner commits; the
+    # savepoint keeps the rest of the transaction usable
+    try:
+        with conn.begin_nested():
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {table}_{suffix} PARTITION OF {table}
+                FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')
+            """))
+
+    except (IntegrityError, ProgrammingError) as e:
+        if not isinstance(e.orig, (psycopg2.errors.UniqueViolation, psycopg2.errors.DuplicateTable)):
+            raise
+
+        logging.info(f'History partition {table}_{suffix} created concurrently')
+
+
+def ensure_partitions(conn, history, window_start, window_end):
+    table = history['table']
+    granularity = history.get('partition', 'day')
+    known = known_partitions.setdefault(table, set())
+    created = created_partitions.setdefault(table, set())
+
+    ts = window_start
+
+    while ts < window_end:
+        start, end, suffix = partition_bounds(ts, granularity)
+
+        if suffix not in known and suffix not in created:
+            create_partition(conn, table, suffix, start, end)
+            created.add(suffix)
+
+        ts = end
+
+
+def commit_partitions(history):
+    """The window transaction committed: its partitions exist and its sweep counts."""
+    if not history:
+        return
+
+    table = history['table']
+    known_partitions.setdefault(table, set()).update(created_partitions.pop(table, set()))
+
+    if table in pending_sweep:
+        last_sweep[table] = pending_sweep.pop(table)
+
+
+def discard_partitions(history):
+    """The window transaction rolled back: its partitions are gone, the next window creates them again."""
+    if not history:
+        return
+
+    created_partitions.pop(history['table'], None)
+    pending_sweep.pop(history['table'], None)
+
+
+def drop_expired_partitions(conn, history, now):
+    """Drop partitions entirely older than the retention, at most once per SWEEP_INTERVAL."""
+    table = history['table']
+
+    if table in pending_sweep or time.monotonic() - last_sweep.get(table, 0) < SWEEP_INTERVAL:
+        return
+
+    pending_sweep[table] = time.monotonic()
+    granularity = history.get('partition', 'day')
+    cutoff = now - timedelta(days=history['retention'])
+
+    partitions = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :table
+    """), {"table": table}).scalars().all()
+
+    for name in partitions:
+        suffix = name[len(table) + 1:]
+        start = datetime.strptime(suffix, '%Y%m' if granularity == 'month' else '%Y%m%d')
+        _, end, _ = partition_bounds(start, granularity)
+
+        if end <= cutoff:
+            logging.info(f'Dropping history partition....{name}')
+            conn.execute(text(f'DROP TABLE IF EXISTS {name}'))
+            known_partitions.get(table, set()).discard(suffix)
@@ -0,0 +1,116 @@
+# Lloyd's reference data sync, ClickHouse pnav.ais_lloyds -> PostgreSQL ais_lloyds
+#
+# The ClickHouse table is streamed block by block into a staging table and merged
+# by key in the same transaction: new keys are inserted, rows that differ are
+# updated and keys no longer in ClickHouse are deleted. Readers keep seeing the
+# previous copy until commit, indexes are kept, and memory is bounded by the block
+# size. Columns appearing in ClickHouse are added to the PostgreSQL table.
+
+from sqlalchemy import text
+
+import time
+import logging
+
+from pgbulk import StagingTable, quote_ident
+
+
+LLOYDS_CH_TABLE = 'pnav.ais_lloyds'
+LLOYDS_TABLE = 'ais_lloyds'
+
+# Lloyd's / IMO ship number, one row per ship
+LLOYDS_KEY = ['imoshipno']
+
+# rows per block streamed from ClickHouse
+LLOYDS_BLOCK = 5000
+
+
+def pg_type(ch_type):
+    while ch_type.startswith(('Nullable(', 'LowCardinality(')):
+        ch_type = ch_type[ch_type.index('(') + 1:-1]
+
+    if ch_type in ('UInt64', 'Int128', 'UInt128', 'Int256', 'UInt256') or ch_type.startswith('Decimal'):
+        return 'numeric'
+    if ch_type.startswith(('Int', 'UInt')):
+        return 'bigint'
+    if ch_type.startswith('Float'):
+        return 'double precision'
+    if ch_type == 'Bool':
+        return 'boolean'
+    if ch_type.startswith('DateTime'):
+        return 'timestamp'
+    if ch_type.startswith('Date'):
+        return 'date'
+
+    return 'text'
+
+
+def get_lloyds_columns(client):
+    """(name, PostgreSQL type) of every column of the ClickHouse table."""
+    result = client.query(f'DESCRIBE TABLE {LLOYDS_CH_TABLE}')
+    return [(row[0], pg_type(row[1])) for row in result.result_rows]
+
+
+def ensure_lloyds_table(conn, columns):
+    """Create ais_lloyds if missing, add new ClickHouse columns and the unique key index."""
+    definition = ', '.join(f'{quote_ident(name)} {type_}' for name, type_ in columns)
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS {LLOYDS_TABLE} ({definition})'))
+
+    existing = set(conn.execute(text('''
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = :table
+    '''), {"table": LLOYDS_TABLE}).scalars().all())
+
+    for name, type_ in columns:
+        if name not in existing:
+            logging.info(f'Lloyds sync....adding column {name} {type_}')
+            conn.execute(text(f'ALTER TABLE {LLOYDS_TABLE} ADD COLUMN {quote_ident(name)} {type_}'))
+
+    index = f"ux_{LLOYDS_TABLE}_{'_'.join(LLOYDS_KEY)}"
+
+    if conn.execute(text(f"SELECT to_regclass('public.{index}') IS NULL")).scalar():
+        # copies made by the old notebook may hold the same ship more than once
+        keys = ', '.join(quote_ident(c) for c in LLOYDS_KEY)
+        match = ' AND '.join(f'a.{quote_ident(c)} = b.{quote_ident(c)}' for c in LLOYDS_KEY)
+
+        conn.execute(text(f'DELETE FROM {LLOYDS_TABLE} a USING {LLOYDS_TABLE} b WHERE {match} AND a.ctid < b.ctid'))
+        conn.execute(text(f'CREATE UNIQUE INDEX {index} ON {LLOYDS_TABLE} ({keys})'))
+
+
+def sync_lloyds(conn, client):
+    """
+    Bring ais_lloyds in line with ClickHouse inside the transaction of `conn`.
+
+    Nothing is written when ClickHouse returns no rows, so an empty or unreachable
+    source never wipes the PostgreSQL copy. Rows without a key cannot be matched
+    and are neither loaded nor kept.
+    """
+    start = time.perf_counter()
+    columns = get_lloyds_columns(client)
+    names = [name for name, _ in columns]
+
+    ensure_lloyds_table(conn, columns)
+
+    stage = StagingTable(conn, LLOYDS_TABLE, names)
+    qry = f"SELECT {', '.join(f'`{c}`' for c in names)} FROM {LLOYDS_CH_TABLE}"
+
+    with client.query_column_block_stream(qry, settings={'max_block_size': LLOYDS_BLOCK}) as stream:
+        for block in stream:
+            stage.copy(zip(*block))
+
+    if stage.rows == 0:
+        logging.info(f'Lloyds sync....{LLOYDS_CH_TABLE} returned no rows, keeping {LLOYDS_TABLE}')
+        return 0
+
+    stage.report('stage')
+
+    missing_key = ' OR '.join(f'{quote_ident(c)} IS NULL' for c in LLOYDS_KEY)
+    skipped = stage.execute(f'DELETE FROM {stage.name} WHERE {missing_key}')
+
+    payload = [c for c in names if c not in LLOYDS_KEY]
+    changed = stage.upsert_into(LLOYDS_KEY, compare=payload)
+    deleted = stage.delete_missing(LLOYDS_KEY)
+
+    logging.info(f'Lloyds sync....{stage.rows} rows, {changed} inserted or updated, {deleted} deleted, '
+                 f'{skipped} without key in {time.perf_counter() - start:.2f}s')
+
+    return changed + deleted
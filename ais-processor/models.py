@@ -0,0 +1,109 @@
+from typing import Optional
+from datetime import datetime
+
+from sqlmodel import Field, SQLModel
+
+
+class Ais_Position(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ts: datetime
+    mmsi: int = Field(index=True, unique=True)
+    navStatus: int
+    navStatusDesc: str
+    longitude: float
+    latitude: float
+    rot: float
+    cog: float
+    sog: float
+    trueHeading: float
+
+
+class Ais_PositionB(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ts: datetime
+    mmsi: int = Field(index=True, unique=True)
+    navStatus: int
+    navStatusDesc: str
+    longitude: float
+    latitude: float
+    rot: float
+    cog: float
+    sog: float
+    trueHeading: float
+
+
+# newest fix per mmsi across class A and class B, source is 'A' or 'B'
+class Ais_Position_Latest(SQLModel, table=True):
+    mmsi: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    source: str
+    ts: datetime = Field(index=True)
+    navStatus: int
+    navStatusDesc: str
+    longitude: float
+    latitude: float
+    rot: float
+    cog: float
+    sog: float
+    trueHeading: float
+    # when the row was written, what readers of new fixes keep their watermark on
+    updated: Optional[datetime] = Field(default=None, index=True)
+
+
+class Ais_Static(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ts: datetime
+    mmsi: int = Field(index=True, unique=True)
+    shipType: int
+    shipTypeDesc: str
+    shipName: str
+    callsign: str
+    imo: Optional[int] = Field(default=None)
+    to_bow: Optional[int] = Field(default=None)
+    to_stern: Optional[int] = Field(default=None)
+    to_port: Optional[int] = Field(default=None)
+    to_starboard: Optional[int] = Field(default=None)
+    destination: Optional[str] = Field(default=None)
+
+
+class Ais_StaticB(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ts: datetime
+    mmsi: int = Field(index=True, unique=True)
+    shipType: int
+    shipTypeDesc: str
+    shipName: str
+    callsign: str
+    vendor: str
+    model: int
+    serial: int
+    imo: Optional[int] = Field(default=None)
+    to_bow: Optional[int] = Field(default=None)
+    to_stern: Optional[int] = Field(default=None)
+    to_port: Optional[int] = Field(default=None)
+    to_starboard: Optional[int] = Field(default=None)
+    destination: Optional[str] = Field(default=None)
+
+
+class Ingest_Checkpoint(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    watermark: datetime
+    updated: Optional[datetime] = Field(default=None)
+
+
+class Vessel_Registry(SQLModel, table=True):
+    mmsi: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    ts: Optional[datetime] = Field(default=None)
+    aisClass: str
+    shipName: Optional[str] = Field(default=None)
+    callsign: Optional[str] = Field(default=None)
+    imo: Optional[int] = Field(default=None)
+    shipType: Optional[int] = Field(default=None)
+    shipTypeDesc: Optional[str] = Field(default=None)
+    to_bow: Optional[int] = Field(default=None)
+    to_stern: Optional[int] = Field(default=None)
+    to_port: Optional[int] = Field(default=None)
+    to_starboard: Optional[int] = Field(default=None)
+    destination: Optional[str] = Field(default=None)
+    vendor: Optional[str] = Field(default=None)
+    flagName: Optional[str] = Field(default=None)
+    draught: Optional[float] = Field(default=None)
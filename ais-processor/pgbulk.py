@@ -0,0 +1,220 @@
+# COPY based bulk loader for PostgreSQL
+#
+# Rows are streamed into a temp staging table with COPY FROM STDIN (text format)
+# and merged into the target table with a single statement, so a batch costs
+# a fixed number of round trips whatever its size.
+
+from datetime import datetime, date
+
+import time
+import logging
+
+
+COPY_CHUNK_SIZE = 65536
+
+
+def quote_ident(name):
+    return '.'.join('"' + part.replace('"', '""') + '"' for part in name.split('.'))
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+
+    # NaN / NaT coming out of pandas are stored as NULL
+    if isinstance(value, (float, datetime)) and value != value:
+        return '\\N'
+
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+
+    if isinstance(value, datetime):
+        text = value.isoformat(sep=' ')
+    elif isinstance(value, date):
+        text = value.isoformat()
+    else:
+        text = str(value)
+
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def records_to_rows(records, columns):
+    for record in records:
+        yield tuple(record.get(c) for c in columns)
+
+
+class CopyStream:
+    """File-like object feeding COPY FROM STDIN from a row iterator without building the whole payload."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buf = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            row = next(self._rows, None)
+
+            if row is None:
+                break
+
+            self._buf += '\t'.join(copy_value(v) for v in row) + '\n'
+            self.count += 1
+
+        if size < 0:
+            size = len(self._buf)
+
+        chunk, self._buf = self._buf[:size], self._buf[size:]
+        return chunk
+
+    readline = read
+
+
+class StagingTable:
+    """
+    Temp table shaped like `table` (restricted to `columns`) living until the
+    end of the current transaction.
+
+    `conn` is a SQLAlchemy Connection with an open transaction; COPY runs on the
+    same DBAPI connection so staging and merge commit together.
+    """
+
+    def __init__(self, conn, table, columns):
+        self.conn = conn
+        self.table = table
+        self.columns = list(columns)
+        # always the session's temp schema, never a permanent table of the same name on search_path
+        self.name = 'pg_temp.stg_' + table.split('.')[-1]
+        self.rows = 0
+        self.elapsed = 0.0
+
+        self._cursor = conn.connection.cursor()
+        self._cols = ', '.join(quote_ident(c) for c in self.columns)
+
+        self.execute(f'DROP TABLE IF EXISTS {self.name}')
+        self.execute(f'''
+            CREATE TEMP TABLE {self.name} ON COMMIT DROP AS
+            SELECT {self._cols} FROM {quote_ident(table)} WITH NO DATA
+        ''')
+
+    def execute(self, sql):
+        start = time.perf_counter()
+        self._cursor.execute(sql)
+        self.elapsed += time.perf_counter() - start
+        return self._cursor.rowcount
+
+    def copy(self, rows):
+        start = time.perf_counter()
+        stream = CopyStream(rows)
+        self._cursor.copy_expert(f'COPY {self.name} ({self._cols}) FROM STDIN', stream, size=COPY_CHUNK_SIZE)
+        self.elapsed += time.perf_counter() - start
+        self.rows += stream.count
+        return stream.count
+
+    def insert_into(self):
+        return self.execute(f'''
+            INSERT INTO {quote_ident(self.table)} ({self._cols})
+            SELECT {self._cols} FROM {self.name}
+        ''')
+
+    def upsert_into(self, conflict, update=None, newer=None, compare=None, refresh=None):
+        """
+        INSERT ... ON CONFLICT (conflict) DO UPDATE from the staging table.
+
+        Only one staged row per conflict key is merged, the one with the highest
+        `newer` column when given. With `newer`, stored rows are only replaced by
+        rows that are not older than them.
+
+        With `compare`, rows whose compared columns equal the stored ones are left
+        alone (no new tuple, no index churn), unless `newer` moved by more than
+        `refresh` seconds.
+        """
+        if update is None:
+            update = [c for c in self.columns if c not in conflict]
+
+        keys = ', '.join(quote_ident(c) for c in conflict)
+        order = keys + (f', {quote_ident(newer)} DESC' if newer else '')
+        target = quote_ident(self.table)
+
+        if update:
+            action = 'DO UPDATE SET ' + ', '.join(f'{quote_ident(c)} = EXCLUDED.{quote_ident(c)}' for c in update)
+            guards = []
+
+            if newer:
+                guards.append(f'{target}.{quote_ident(newer)} <= EXCLUDED.{quote_ident(newer)}')
+
+            if compare:
+                stored = ', '.join(f'{target}.{quote_ident(c)}' for c in compare)
+                staged = ', '.join(f'EXCLUDED.{quote_ident(c)}' for c in compare)
+                changed = f'ROW({stored}) IS DISTINCT FROM ROW({staged})'
+
+                if newer and refresh:
+                    changed = f"({changed} OR {target}.{quote_ident(newer)} < EXCLUDED.{quote_ident(newer)} - INTERVAL '{int(refresh)} seconds')"
+
+                guards.append(changed)
+
+            if guards:
+                action += ' WHERE ' + ' AND '.join(guards)
+        else:
+            action = 'DO NOTHING'
+
+        return self.execute(f'''
+            INSERT INTO {target} ({self._cols})
+            SELECT DISTINCT ON ({keys}) {self._cols} FROM {self.name}
+            ORDER BY {order}
+            ON CONFLICT ({keys}) {action}
+        ''')
+
+    def update_into(self, key, update=None):
+        if update is None:
+            update = [c for c in self.columns if c not in key]
+
+        sets = ', '.join(f'{quote_ident(c)} = s.{quote_ident(c)}' for c in update)
+        match = ' AND '.join(f't.{quote_ident(c)} = s.{quote_ident(c)}' for c in key)
+
+        return self.execute(f'''
+            UPDATE {quote_ident(self.table)} t
+            SET {sets}
+            FROM {self.name} s
+            WHERE {match}
+        ''')
+
+    def delete_missing(self, key):
+        """Delete the target rows whose key was not staged, for full table syncs."""
+        match = ' AND '.join(f's.{quote_ident(c)} = t.{quote_ident(c)}' for c in key)
+
+        return self.execute(f'''
+            DELETE FROM {quote_ident(self.table)} t
+            WHERE NOT EXISTS (SELECT 1 FROM {self.name} s WHERE {match})
+        ''')
+
+    def report(self, action='loaded'):
+        rate = self.rows / self.elapsed if self.elapsed > 0 else 0
+        logging.info(f'Bulk {action} {self.table}....{self.rows} rows in {self.elapsed:.2f}s ({rate:.0f} rows/sec)')
+
+
+def bulk_insert(conn, table, columns, rows):
+    stage = StagingTable(conn, table, columns)
+    stage.copy(rows)
+    affected = stage.insert_into()
+    stage.report('insert')
+
+    return affected
+
+
+def bulk_upsert(conn, table, columns, rows, conflict, update=None, newer=None, compare=None, refresh=None):
+    stage = StagingTable(conn, table, columns)
+    stage.copy(rows)
+    affected = stage.upsert_into(conflict, update=update, newer=newer, compare=compare, refresh=refresh)
+    stage.report('upsert')
+
+    return affected
+
+
+def bulk_update(conn, table, columns, rows, key, update=None):
+    stage = StagingTable(conn, table, columns)
+    stage.copy(rows)
+    affected = stage.update_into(key, update=update)
+    stage.report('update')
+
+    return affected
@@ -0,0 +1,91 @@
+# Vessel registry, one canonical record per mmsi
+#
+# Merges class A static data (Type 5, ais_static), class B static data (Type 24,
+# ais_staticb) and, when the table exists, Lloyd's reference data (ais_lloyds).
+#
+# Precedence:
+#   - name, callsign, ship type and dimensions come from class A, then class B,
+#     then Lloyd's (name / callsign only); empty strings and type 0 count as missing
+#   - imo comes from class A when non zero, else Lloyd's
+#   - destination is class A only, vendor class B only
+#   - flag and draught are Lloyd's only
+#   - aisClass is 'A' whenever a Type 5 message exists for the vessel
+
+from sqlalchemy import text
+
+import time
+import logging
+
+from models import Vessel_Registry
+
+
+registry_columns = [c.name for c in Vessel_Registry.__table__.columns]
+
+lloyds_query = '''
+    SELECT DISTINCT ON (mmsi) mmsi, shipname, callsign, imo, flagname, draught
+    FROM (
+        SELECT maritimemobileserviceidentitymmsinumber::text::bigint AS mmsi,
+            NULLIF(shipname::text, '') AS shipname,
+            NULLIF(callsign::text, '') AS callsign,
+            CASE WHEN imoshipno::text ~ '^[0-9]{1,9}$' THEN imoshipno::text::bigint END AS imo,
+            NULLIF(flagname::text, '') AS flagname,
+            CASE WHEN draught::text ~ '^[0-9]+([.][0-9]+)?$' THEN draught::text::float END AS draught
+        FROM public.ais_lloyds
+        WHERE maritimemobileserviceidentitymmsinumber::text ~ '^[0-9]{1,9}$'
+    ) l
+    ORDER BY mmsi
+'''
+
+no_lloyds_query = '''
+    SELECT NULL::bigint AS mmsi, NULL::text AS shipname, NULL::text AS callsign,
+        NULL::bigint AS imo, NULL::text AS flagname, NULL::float AS draught
+    WHERE false
+'''
+
+merge_query = '''
+    WITH l AS (
+        {lloyds}
+    )
+    INSERT INTO vessel_registry ({columns})
+    SELECT COALESCE(a.mmsi, b.mmsi) AS mmsi,
+        GREATEST(a.ts, b.ts) AS ts,
+        CASE WHEN a.mmsi IS NOT NULL THEN 'A' ELSE 'B' END AS "aisClass",
+        COALESCE(NULLIF(a."shipName", ''), NULLIF(b."shipName", ''), l.shipname) AS "shipName",
+        COALESCE(NULLIF(a.callsign, ''), NULLIF(b.callsign, ''), l.callsign) AS callsign,
+        COALESCE(NULLIF(a.imo, 0), l.imo) AS imo,
+        CASE WHEN a."shipType" > 0 THEN a."shipType" ELSE NULLIF(b."shipType", 0) END AS "shipType",
+        CASE WHEN a."shipType" > 0 THEN a."shipTypeDesc" WHEN b."shipType" > 0 THEN b."shipTypeDesc" END AS "shipTypeDesc",
+        COALESCE(NULLIF(a.to_bow, 0), b.to_bow) AS to_bow,
+        COALESCE(NULLIF(a.to_stern, 0), b.to_stern) AS to_stern,
+        COALESCE(NULLIF(a.to_port, 0), b.to_port) AS to_port,
+        COALESCE(NULLIF(a.to_starboard, 0), b.to_starboard) AS to_starboard,
+        NULLIF(a.destination, '') AS destination,
+        NULLIF(b.vendor, '') AS vendor,
+        l.flagname AS "flagName",
+        l.draught AS draught
+    FROM public.ais_static a
+    FULL JOIN public.ais_staticb b ON b.mmsi = a.mmsi
+    LEFT JOIN l ON l.mmsi = COALESCE(a.mmsi, b.mmsi)
+    ON CONFLICT (mmsi) DO UPDATE SET {updates}
+    WHERE ROW({stored}) IS DISTINCT FROM ROW({staged})
+'''
+
+
+def refresh_registry(conn):
+    """Rebuild vessel_registry in one statement, rows that did not change are left alone."""
+    start = time.perf_counter()
+    has_lloyds = conn.execute(text("SELECT to_regclass('public.ais_lloyds') IS NOT NULL")).scalar()
+    payload = [c for c in registry_columns if c != 'mmsi']
+
+    qry = merge_query.format(
+        lloyds=lloyds_query if has_lloyds else no_lloyds_query,
+        columns=', '.join(f'"{c}"' for c in registry_columns),
+        updates=', '.join(f'"{c}" = EXCLUDED."{c}"' for c in payload),
+        stored=', '.join(f'vessel_registry."{c}"' for c in payload),
+        staged=', '.join(f'EXCLUDED."{c}"' for c in payload)
+    )
+
+    rows = conn.exec_driver_sql(qry).rowcount
+    logging.info(f'Vessel registry refreshed....{rows} changed in {time.perf_counter() - start:.2f}s')
+
+    return rows
@@ -0,0 +1,179 @@
+# Ingestion sources run by aisingest.py
+#
+# name        : label used in logs
+# kind        : 'stream' reads new messages window by window after a checkpoint
+# ch_table    : ClickHouse source table
+# ch_latest   : optional ReplacingMergeTree copy of ch_table keeping the latest row per mmsi
+#               (see ch_latest.sql), read instead of ch_table when set
+# columns     : (target column, ClickHouse expression) in projection order
+# target      : SQLModel table the rows are upserted into (one row per mmsi)
+# checkpoint  : key of the watermark in ingest_checkpoint the source resumes from
+# health      : optional msgType written to db_health after each window
+# window      : window length in seconds when caught up
+# max_window  : largest window in seconds while catching up after an outage
+# overlap     : optional, seconds re-read behind the checkpoint for messages landing late
+#               in ClickHouse (default OVERLAP_SECONDS in aisingest.py)
+# pipelined   : fetch the next window while the current one is written
+# history     : optional append-only copy of the messages, see history.py
+#               table     : partitioned table name
+#               interval  : keep the first message per vessel per interval seconds, 0 keeps all
+#               partition : 'day' or 'month'
+#               retention : days kept before partitions are dropped
+# reconcile   : optional low priority pass re-reading the latest message of every vessel
+#               listed in a PG table, catching whatever the stream missed
+#               lookup    : PG table listing the vessels
+#               lookback  : how far back to look for their messages, in minutes
+#               every     : seconds between passes
+#               pause     : seconds between chunks of LOOKUP_CHUNK vessels
+# unified   : optional table shared by several sources holding the newest row per mmsi
+#               across them, merged in the same transaction as the target
+#               table     : SQLModel table, mmsi primary key
+#               source    : value of its source column for this source
+# change_refresh : optional, skip rows whose payload is unchanged for the vessel (see changes.py)
+#               unless the stored ts is older than this many seconds
+# interval    : sleep between iterations, in seconds
+
+from models import Ais_Position, Ais_PositionB, Ais_Position_Latest, Ais_Static, Ais_StaticB
+
+
+position_columns = [
+    ("ts", "ts"),
+    ("mmsi", "mmsi"),
+    ("navStatus", "navStatus"),
+    ("navStatusDesc", "navStatusDesc"),
+    ("rot", "rot"),
+    ("sog", "sog"),
+    ("cog", "cog"),
+    ("trueHeading", "trueHeading"),
+    ("longitude", "longitude"),
+    ("latitude", "latitude")
+]
+
+# type 18 carries no navigational status nor rate of turn
+position_b_columns = [
+    ("ts", "ts"),
+    ("mmsi", "mmsi"),
+    ("navStatus", "0"),
+    ("navStatusDesc", "''"),
+    ("rot", "0"),
+    ("sog", "sog"),
+    ("cog", "cog"),
+    ("trueHeading", "trueHeading"),
+    ("longitude", "longitude"),
+    ("latitude", "latitude")
+]
+
+static_columns = [
+    ("ts", "ts"),
+    ("mmsi", "mmsi"),
+    ("shipType", "shipType"),
+    ("shipTypeDesc", "shipTypeDesc"),
+    ("shipName", "shipName"),
+    ("imo", "imo"),
+    ("callsign", "callsign"),
+    ("to_bow", "to_bow"),
+    ("to_stern", "to_stern"),
+    ("to_port", "to_port"),
+    ("to_starboard", "to_starboard"),
+    ("destination", "destination")
+]
+
+# type 24 carries vendor id instead of imo / destination
+static_b_columns = [
+    ("ts", "ts"),
+    ("mmsi", "mmsi"),
+    ("shipType", "shipType"),
+    ("shipTypeDesc", "shipTypeDesc"),
+    ("shipName", "shipName"),
+    ("callsign", "callsign"),
+    ("vendor", "vendor"),
+    ("serial", "serial"),
+    ("model", "model"),
+    ("to_bow", "to_bow"),
+    ("to_stern", "to_stern"),
+    ("to_port", "to_port"),
+    ("to_starboard", "to_starboard"),
+    ("destination", "''")
+]
+
+
+SOURCES = [
+    {
+        "name": "position",
+        "kind": "stream",
+        "ch_table": "pnav.ais_position",
+        "columns": position_columns,
+        "target": Ais_Position,
+        "checkpoint": "pnav_aisposition",
+        "health": "position",
+        "window": 600,
+        "max_window": 21600,
+        "pipelined": True,
+        "history": {
+            "table": "ais_position_history",
+            "interval": 60,
+            "partition": "day",
+            "retention": 30
+        },
+        "unified": {
+            "table": Ais_Position_Latest,
+            "source": "A"
+        },
+        "change_refresh": 900,
+        "interval": 2
+    },
+    {
+        "name": "position_b",
+        "kind": "stream",
+        "ch_table": "pnav.ais_type18",
+        "columns": position_b_columns,
+        "target": Ais_PositionB,
+        "checkpoint": "pnav_aisposition_b",
+        "health": "position",
+        "window": 600,
+        "max_window": 21600,
+        "pipelined": True,
+        "unified": {
+            "table": Ais_Position_Latest,
+            "source": "B"
+        },
+        "change_refresh": 900,
+        "interval": 2
+    },
+    {
+        "name": "static",
+        "kind": "stream",
+        "ch_table": "pnav.ais_static",
+        "columns": static_columns,
+        "target": Ais_Static,
+        "checkpoint": "pnav_aisstatic",
+        "window": 600,
+        "max_window": 86400,
+        "reconcile": {
+            "lookup": "ais_position",
+            "lookback": 1440,
+            "every": 21600,
+            "pause": 1
+        },
+        "change_refresh": 86400,
+        "interval": 30
+    },
+    {
+        "name": "static_b",
+        "kind": "stream",
+        "ch_table": "pnav.ais_type24",
+        "columns": static_b_columns,
+        "target": Ais_StaticB,
+        "checkpoint": "pnav_aisstatic_b",
+        "window": 600,
+        "max_window": 86400,
+        "reconcile": {
+            "lookup": "ais_positionb",
+            "lookback": 1440,
+            "every": 21600,
+            "pause": 1
+        },
+        "change_refresh": 86400,
+        "interval": 30
+    }
+]
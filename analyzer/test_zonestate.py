@@ -0,0 +1,108 @@
+# Unit tests of the in-memory zone logic, no database needed
+#
+# python -m pytest analyzer
+
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from zoneengine import ZoneRegistry
+from zonestate import PositionWatermark, LastFixIndex, PendingTransitions, zone_transition, ENTER, EXIT, TIMEOUT
+
+
+T0 = datetime(2026, 1, 1, 12)
+
+# a strip 1 degree wide, like a sector between two meridians
+strip = {
+    "type": "Polygon",
+    "coordinates": [[[101.0, 1.0], [102.0, 1.0], [102.0, 3.0], [101.0, 3.0], [101.0, 1.0]]]
+}
+
+
+def test_zone_transition():
+    assert zone_transition(None, True, False) == ENTER
+    assert zone_transition(None, False, False) is None
+    assert zone_transition({}, False, False) == EXIT
+    assert zone_transition({}, True, True) == TIMEOUT
+    assert zone_transition({}, True, False) is None
+
+
+def test_segment_crossing_sector_strip():
+    registry = ZoneRegistry([strip])
+
+    # west of the strip to east of it, and a fix that did not move
+    seg, zone, fraction = registry.crossings([100.5, 100.5], [2.0, 2.0], [102.5, 100.5], [2.0, 2.0])
+
+    assert seg.tolist() == [0, 0]
+    assert zone.tolist() == [0, 0]
+    assert fraction == pytest.approx([0.25, 0.75])
+
+    # both ends outside, the strip passed through between the two fixes
+    assert not registry.membership([100.5, 102.5], [2.0, 2.0]).any()
+
+
+def test_segment_start_needs_a_recent_fix():
+    fixes = LastFixIndex(1800)
+    fixes.advance(pd.DataFrame({"mmsi": [1, 2], "ts": [T0, T0 - timedelta(hours=1)], "longitude": [100.5, 100.5], "latitude": [2.0, 2.0]}))
+
+    starts = fixes.starts([
+        {"mmsi": 1, "ts": T0 + timedelta(minutes=10)},
+        {"mmsi": 2, "ts": T0 + timedelta(minutes=10)},
+        {"mmsi": 3, "ts": T0 + timedelta(minutes=10)},
+        {"mmsi": 1, "ts": T0}
+    ])
+
+    assert starts == [(T0, 100.5, 2.0), None, None, None]
+
+
+def test_dwell_flip_back():
+    pending = PendingTransitions()
+    key = (1, 0)
+    at = lambda seconds: (T0 + timedelta(seconds=seconds), 101.5, 2.0)
+
+    assert pending.hold(key, ENTER, at(0), T0, 120) is None
+    assert pending.hold(key, ENTER, at(60), T0 + timedelta(seconds=60), 120) is None
+
+    # back out before the dwell ran out: nothing committed, the next entry starts over
+    pending.clear(key)
+    assert pending.hold(key, ENTER, at(90), T0 + timedelta(seconds=90), 120) is None
+    assert pending.hold(key, ENTER, at(180), T0 + timedelta(seconds=180), 120) is None
+
+    # committed where the second entry started
+    assert pending.hold(key, ENTER, at(210), T0 + timedelta(seconds=210), 120) == at(90)
+    assert key not in pending.pending
+
+    # a flip to the other event restarts the hold
+    assert pending.hold(key, EXIT, at(300), T0 + timedelta(seconds=300), 120) is None
+    assert pending.hold(key, ENTER, at(360), T0 + timedelta(seconds=360), 120) is None
+    assert pending.pending[key] == (ENTER, at(360))
+
+
+def test_overlap_replay():
+    watermark = PositionWatermark(T0 - timedelta(hours=1), 300)
+
+    first = pd.DataFrame({"mmsi": [1, 2], "ts": [T0 - timedelta(seconds=30), T0], "updated": [T0, T0]})
+    assert len(watermark.new_fixes(first)) == 2
+    watermark.advance(first)
+
+    assert watermark.since() == T0 - timedelta(seconds=300)
+
+    # the overlap brings the same rows back, with a newer fix of vessel 2 and a
+    # fix of vessel 3 hours old but written late by a lagging source
+    replay = pd.DataFrame({
+        "mmsi": [1, 2, 3],
+        "ts": [T0 - timedelta(seconds=30), T0 + timedelta(seconds=10), T0 - timedelta(hours=3)],
+        "updated": [T0, T0 + timedelta(seconds=20), T0 + timedelta(seconds=60)]
+    })
+    new = watermark.new_fixes(replay)
+
+    assert new['mmsi'].tolist() == [2, 3]
+    watermark.advance(new)
+
+    assert watermark.watermark == T0 + timedelta(seconds=60)
+    assert watermark.latest == T0 + timedelta(seconds=10)
+
+    # rows written before the overlap are no longer read, nor tracked
+    watermark.advance_to(T0 + timedelta(seconds=330))
+    assert set(watermark.last_fix) == {3}
@@ -12,30 +12,30 @@ import gc
 import os
 import time
 import pandas as pd
-import duckdb
 import psycopg2
 import platform
 import logging
 
 from polygons import *
+from pgbulk import bulk_insert, bulk_update, records_to_rows
+from zoneengine import ZoneRegistry, DuckDBZoneEngine
+from zoneshard import PartitionLeases, SHARD_FILTER
+from zonepostgis import PostGISZoneEngine
+from zonestate import OpenVisitIndex, PositionWatermark, LastFixIndex, PendingTransitions, zone_transition, ENTER, EXIT, TIMEOUT
 
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-# install duckdb extensions
-# wget http://extensions.duckdb.org/v1.2.0/linux_amd64_gcc4/spatial.duckdb_extension.gz
-duckdb.sql("INSTALL spatial")
+# duckdb engine: the spatial extension is never installed at run time, it comes from
+# DUCKDB_EXTENSION when set, e.g. ./spatial.duckdb_extension_osx_arm64 on MacOS, or from
+# the local extension directory (filled when the docker image is built)
+# wget http://extensions.duckdb.org/v1.4.1/linux_amd64/spatial.duckdb_extension.gz
+DUCKDB_EXTENSION = os.environ.get('DUCKDB_EXTENSION')
 
-# loading spatial extension
-duckdb.sql("LOAD spatial")
-
-
-# if platform.processor().lower() == 'arm':
-#     duckdb.sql("LOAD './analyzer/spatial.duckdb_extension_osx_arm64'")     # for MacOS
-# else:
-#     duckdb.sql("LOAD './analyzer/spatial.duckdb_extension'")     # for Linux
+# database file keeping the zones table between starts, stored as zones-<fingerprint>.duckdb per zone set
+DUCKDB_DATABASE = os.environ.get('DUCKDB_DATABASE', 'zones.duckdb')
 
 
 
@@ -54,16 +54,92 @@ zones = [
     tssSouthbound_db
 ]
 
+# 'shapely' (STRtree registry, default), 'duckdb' (spatial join) or
+# 'postgis' (whole cycle computed in the database, see zonepostgis.py)
+ZONE_ENGINE = os.environ.get('ZONE_ENGINE', 'shapely')
+
+zone_engines = {
+    'shapely': ZoneRegistry,
+    'duckdb': DuckDBZoneEngine,
+    'postgis': PostGISZoneEngine
+}
+
+# debouncing of boundary jitter per zone index
+#   buffer : metres, a vessel enters once that far inside the zone and leaves once that far outside
+#   dwell  : seconds a vessel must stay in / out before ENTER / EXIT is committed, timed from the first fix
+ZONE_HYSTERESIS = {
+    10: {"buffer": 100, "dwell": 120},
+    11: {"buffer": 100, "dwell": 120}
+}
 
 entire_tss_region = get_entire_tss_region_setting()
 entire_sector789_region = get_entire_sector789_region_setting()
 
+zone_engine_options = {
+    'duckdb': {"database": DUCKDB_DATABASE, "extension": DUCKDB_EXTENSION},
+    # the TSS region prefilter of get_vessel_data(), applied in the cycle statement
+    'postgis': {"region": entire_tss_region}
+}
+
+# zone polygons parsed once, membership of a whole batch in one call
+zone_engine = zone_engines[ZONE_ENGINE](
+    zones,
+    buffers=[ZONE_HYSTERESIS.get(idx, {}).get('buffer', 0) for idx in range(len(zones))],
+    **zone_engine_options.get(ZONE_ENGINE, {})
+)
+zone_dwell = [ZONE_HYSTERESIS.get(idx, {}).get('dwell', 0) for idx in range(len(zones))]
+
+
+tss_region = ZoneRegistry([entire_tss_region])
+
+# seconds re-read behind the position watermark (on the write time of the rows), for
+# rows of a transaction committing late; longer than an ingest window's write
+WATERMARK_OVERLAP = 300
+
+# open visits without a fix for this many seconds are closed by the sweep
+STALE_SECONDS = 3600
+
+# seconds between sweeps of the open visits
+SWEEP_INTERVAL = 60
+
+# seconds between position / tsCurrent write backs of a vessel still inside a zone, None never writes them
+CURRENT_UPDATE_SECONDS = 300
+
+# TSS lanes, visits longer than TSS_TIMEOUT are timed out
+TSS_ZONES = (10, 11)
+TSS_TIMEOUT = timedelta(hours=6)
+
+# vessels are split into mmsi % ZONE_PARTITIONS partitions shared out between the
+# running analyzers (see zoneshard.py), each one only handles the vessels of its own; 0 disables
+ZONE_PARTITIONS = int(os.environ.get('ZONE_PARTITIONS', '16'))
+
+# None handles every vessel, for a single analyzer
+partition_leases = PartitionLeases(lambda: get_pgConn(), ZONE_PARTITIONS) if ZONE_PARTITIONS > 0 else None
+
+# open visits by (mmsi, zone), loaded on the first cycle and kept up to date after each commit
+open_visits = OpenVisitIndex(partition_leases)
+
+# the first cycle reads the rows written in the last 5 days, later ones only those past the watermark
+position_watermark = PositionWatermark(datetime.now(UTC).replace(tzinfo=None) - timedelta(days=5), WATERMARK_OVERLAP)
+
+# fixes further apart than this many seconds are not joined into a track segment
+MAX_SEGMENT_SECONDS = 1800
+
+# previous fix of each vessel, for the boundary crossings between two fixes and the
+# silence measured by the sweep; kept for STALE_SECONDS
+last_fixes = LastFixIndex(MAX_SEGMENT_SECONDS)
+
+# ENTER / EXIT waiting for their zone's dwell
+pending_transitions = PendingTransitions()
+
+last_sweep = 0
+
 
 
 class Ais_Position(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     ts: datetime
-    mmsi: int = Field(index=True)
+    mmsi: int = Field(index=True, unique=True)
     navStatus: int
     navStatusDesc: str
     longitude: float
@@ -87,6 +163,22 @@ class Ais_VesselInZone(SQLModel, table=True):
     zone: Optional[int] = Field(default=None)
 
 
+# append-only log of zone transitions, event is ENTER, EXIT or TIMEOUT
+class Ais_ZoneEvent(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ts: datetime = Field(index=True)
+    mmsi: int = Field(index=True)
+    zone: int
+    event: str
+    longitude: float
+    latitude: float
+
+
+visit_columns = [c.name for c in Ais_VesselInZone.__table__.columns]
+insert_columns = [c for c in visit_columns if c != 'id']
+event_columns = [c.name for c in Ais_ZoneEvent.__table__.columns if c.name != 'id']
+
+
 
 # Database URL (adjust username, password, host, port, database name)
 # pswd = 'Az@HoePinc0615'
@@ -111,12 +203,17 @@ def get_pgEngine():
 
 
 def get_pgConn():
+    # keepalives, so a dead peer drops the session (and its partition locks) quickly
     conn = psycopg2.connect(
         dbname="pnav",
         user="postgresadmin",
         password="m4r1t1m3",
         host="marineai2.cxwk8yige5f2.ap-southeast-5.rds.amazonaws.com",
-        port="5432"
+        port="5432",
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=3
     )
 
     return conn
@@ -125,8 +222,12 @@ def get_pgConn():
 def create_db_and_tables():
     SQLModel.metadata.create_all(get_pgEngine())
 
+    if ZONE_ENGINE == 'postgis':
+        with get_pgEngine().begin() as conn:
+            zone_engine.create_zone_table(conn)
 
-def get_ais_position_data():
+
+def get_ais_position_data(updated_min):
     # results = None
     # with Session(engine) as session:
     #     statement = (
@@ -138,137 +239,311 @@ def get_ais_position_data():
 
     #     results = session.exec(statement).all()
 
-    query = text("""
+    shard = f'AND {SHARD_FILTER}' if partition_leases else ''
+
+    query = text(f"""
         SELECT *
-        FROM public.ais_position
-        WHERE latitude >= :lat_min AND latitude <= :lat_max AND ts >= :ts_min
+        FROM public.ais_position_latest
+        WHERE latitude >= :lat_min AND latitude <= :lat_max AND updated >= :updated_min {shard}
         ORDER BY "ts"
     """)
 
     # Define parameters
-    params = {"lat_min": -90, "lat_max": 90, "ts_min": datetime.now(UTC) - timedelta(days=5)}
+    params = {"lat_min": -90, "lat_max": 90, "updated_min": updated_min, **(partition_leases.params() if partition_leases else {})}
     df = pd.read_sql(query, con=get_pgEngine(), params=params)  
 
     return df
 
 
 def get_vessel_data():
-    ais_data = get_ais_position_data()
+    """
+    Fixes new since the previous cycle within the TSS region or whose segment from
+    the previous fix crosses a zone, with their crossings, and every new fix for
+    the watermark and the track segments.
+    """
+    ais_data = position_watermark.new_fixes(get_ais_position_data(position_watermark.since()))
+    logging.info(f'New fixes....{len(ais_data)}')
 
-    df = duckdb.sql(f'''
-        SELECT *
-        FROM ais_data
-        WHERE ST_Within(ST_Point(longitude, latitude), ST_GeomFromGeoJSON({entire_tss_region})) 
-            -- OR ST_Within(ST_Point(longitude, latitude), ST_GeomFromGeoJSON({entire_sector789_region}))
-    ''').fetchdf()
+    # segments of every new fix, zone 0 and the sectors reach outside the TSS region
+    records = ais_data.to_dict(orient='records')
+    crossed = get_crossings(records, last_fixes.starts(records))
+
+    # the region only filters point membership, entire_sector789_region stays left out of it
+    keep = tss_region.membership(ais_data['longitude'].to_numpy(), ais_data['latitude'].to_numpy())[:, 0]
+    keep[[cnt for cnt, _ in crossed]] = True
+    index = keep.cumsum() - 1
+
+    data = [i for i, kept in zip(records, keep) if kept]
+    crossed = {(int(index[cnt]), zone): crossings for (cnt, zone), crossings in crossed.items()}
 
-    del ais_data
+    fixes = ais_data[['mmsi', 'ts', 'updated', 'longitude', 'latitude']]
+
+    del ais_data, records
     gc.collect()
 
-    return df.to_dict(orient='records') 
+    return data, crossed, fixes
+
+
+def zone_event(ts, mmsi, zone, event, longitude, latitude):
+    return {"ts": ts, "mmsi": mmsi, "zone": zone, "event": event, "longitude": longitude, "latitude": latitude}
+
+
+def get_crossings(data, starts):
+    """
+    Boundary crossings of the segments from the previous fix to each fix, as
+    {(record index, zone index): [(ts, longitude, latitude), ...]} in track order,
+    ts and position interpolated along the segment.
+    """
+    records = [cnt for cnt, start in enumerate(starts) if start is not None]
 
+    seg, zone, fraction = zone_engine.crossings(
+        [starts[cnt][1] for cnt in records], [starts[cnt][2] for cnt in records],
+        [data[cnt]['longitude'] for cnt in records], [data[cnt]['latitude'] for cnt in records]
+    )
+
+    crossed = {}
+
+    for s, z, f in zip(seg, zone, fraction):
+        cnt = records[s]
+        ts0, lon0, lat0 = starts[cnt]
+        i = data[cnt]
+
+        crossed.setdefault((cnt, int(z)), []).append((
+            ts0 + (i['ts'] - ts0) * f,
+            lon0 + (i['longitude'] - lon0) * f,
+            lat0 + (i['latitude'] - lat0) * f
+        ))
+
+    return crossed
+
+
+def tss_timed_out(visit):
+    # a vessel is not expected to stay in a TSS lane longer than TSS_TIMEOUT
+    return visit['zone'] in TSS_ZONES and datetime.now() - visit['tsDetected'] > TSS_TIMEOUT
+
+
+def current_due(visit, ts):
+    if CURRENT_UPDATE_SECONDS is None:
+        return False
+
+    return pd.isnull(visit['tsCurrent']) or (ts - visit['tsCurrent']).total_seconds() >= CURRENT_UPDATE_SECONDS
 
-def upsert_ais_position(data):
+
+def write_transitions(items_to_insert, items_to_update, events):
+    """Visit inserts / updates and their events in one transaction, then the open visit index follows."""
+    if len(items_to_insert) == 0 and len(items_to_update) == 0 and len(events) == 0:
+        return
+
+    with get_pgEngine().connect() as conn:
+        try:
+            with conn.begin():
+                if len(items_to_update) != 0: bulk_update(conn, Ais_VesselInZone.__tablename__, visit_columns, records_to_rows(items_to_update, visit_columns), key=['id'])
+                if len(items_to_insert) != 0: bulk_insert(conn, Ais_VesselInZone.__tablename__, insert_columns, records_to_rows(items_to_insert, insert_columns))
+                if len(events) != 0: bulk_insert(conn, Ais_ZoneEvent.__tablename__, event_columns, records_to_rows(events, event_columns))
+
+            open_visits.apply(conn, items_to_update)
+            conn.commit()
+
+        except Exception:
+            open_visits.invalidate()
+            raise
+
+
+def upsert_ais_position(data, crossed):
+    """
+    Run the zone state machine over a batch of fixes, with the boundary crossings
+    of their segments from get_crossings(). Only transitions are written:
+    ENTER opens a visit, EXIT and TIMEOUT close it, each with a row in
+    ais_zoneevent. The position of a vessel still inside a zone is written back
+    at most every CURRENT_UPDATE_SECONDS.
+    """
     logging.info(f'Upserting data....{len(data)}')
 
     items_to_update = []
     items_to_insert = []
-    current_vessels_zone = []
+    events = []
+
+    if not open_visits.loaded:
+        with get_pgEngine().connect() as conn:
+            open_visits.load(conn)
+
+    logging.info(f'Loading data....{len(open_visits.visits)}')
+
+    # every vessel against every zone in one call, row cnt / column idx; vessels
+    # enter zones when deep inside and stay in them while near (see ZONE_HYSTERESIS)
+    deep, near = zone_engine.hysteresis([i['longitude'] for i in data], [i['latitude'] for i in data])
+
+    for cnt, i in enumerate(data):
+        for idx, zone in enumerate(zones):
+            # the index only changes once the cycle is committed, payloads are new dicts
+            visit = open_visits.get(i['mmsi'], idx)
+            in_zone = near[cnt, idx] if visit is not None else deep[cnt, idx]
+            event = zone_transition(visit, in_zone, visit is not None and tss_timed_out(visit))
+            # zone boundaries crossed since the previous fix, so entries, exits and zones
+            # passed through between two fixes are timed where they happened
+            crossings = crossed.get((cnt, idx), [])
+
+            # the last crossing of the segment is where the vessel entered or left the zone
+            ts, longitude, latitude = crossings[-1] if crossings else (i['ts'], i['longitude'], i['latitude'])
+
+            if event in (ENTER, EXIT) and zone_dwell[idx]:
+                held = pending_transitions.hold((i['mmsi'], idx), event, (ts, longitude, latitude), i['ts'], zone_dwell[idx])
+
+                if held is None:
+                    continue
+
+                # committed at the fix that started it
+                ts, longitude, latitude = held
+
+            elif event is None:
+                pending_transitions.clear((i['mmsi'], idx))
+
+            if event == ENTER:
+                logging.info(f"[ENTER] :: vessel {i['mmsi']} entered zone {idx}")
+                items_to_insert.append({
+                    "tsDetected": ts,
+                    "mmsi": i['mmsi'],
+                    "navStatus": i['navStatus'],
+                    "navStatusDesc": i['navStatusDesc'],
+                    "longitude": i['longitude'],
+                    "latitude": i['latitude'], 
+                    "tsCurrent": i['ts'],
+                    "tsOut": None,
+                    "zone": idx                       
+                })
+                events.append(zone_event(ts, i['mmsi'], idx, ENTER, longitude, latitude))
+
+            elif event == EXIT:
+                logging.info(f"[EXIT] :: vessel {i['mmsi']} exit zone {idx}")
+                items_to_update.append({**visit, "tsOut": ts})
+                events.append(zone_event(ts, i['mmsi'], idx, EXIT, longitude, latitude))
+
+            elif visit is None and len(crossings) >= 2 and (crossings[-1][0] - crossings[0][0]).total_seconds() >= zone_dwell[idx]:
+                # in and out again between two fixes, recorded as a closed visit
+                (ts_in, lon_in, lat_in), (ts_out, lon_out, lat_out) = crossings[0], crossings[-1]
+
+                logging.info(f"[PASS] :: vessel {i['mmsi']} crossed zone {idx}")
+                items_to_insert.append({
+                    "tsDetected": ts_in,
+                    "mmsi": i['mmsi'],
+                    "navStatus": i['navStatus'],
+                    "navStatusDesc": i['navStatusDesc'],
+                    "longitude": lon_out,
+                    "latitude": lat_out,
+                    "tsCurrent": ts_out,
+                    "tsOut": ts_out,
+                    "zone": idx
+                })
+                events.append(zone_event(ts_in, i['mmsi'], idx, ENTER, lon_in, lat_in))
+                events.append(zone_event(ts_out, i['mmsi'], idx, EXIT, lon_out, lat_out))
+
+            elif event == TIMEOUT:
+                logging.info(f"[TIMEOUT] :: vessel {i['mmsi']} timed out in zone {idx}")
+                now = datetime.now()
+                items_to_update.append({**visit, "tsOut": now, "longitude": i['longitude'], "latitude": i['latitude'], "tsCurrent": i['ts']})
+                events.append(zone_event(now, i['mmsi'], idx, TIMEOUT, i['longitude'], i['latitude']))
+
+            elif visit is not None and current_due(visit, i['ts']):
+                items_to_update.append({**visit, "longitude": i['longitude'], "latitude": i['latitude'], "tsCurrent": i['ts']})
+
+    logging.info(f'Commiting to database....{len(events)} events')
+    write_transitions(items_to_insert, items_to_update, events)
+    logging.info(f'Upserting data done....')
+
+    del data
+    gc.collect()
+
+    return 0            
+
+
+def visit_last_seen(visit):
+    """(ts, longitude, latitude) the vessel of an open visit was last seen at."""
+    fix = last_fixes.fixes.get(visit['mmsi'])
+    stored = (visit['tsDetected'] if pd.isnull(visit['tsCurrent']) else visit['tsCurrent'], visit['longitude'], visit['latitude'])
+
+    return fix if fix is not None and fix[0] > stored[0] else stored
 
-    query = text("""
-        SELECT *
-        FROM public.ais_vesselinzone
-        WHERE "tsOut" IS NULL
-        ORDER BY "tsDetected" DESC
-    """)
 
-    df = pd.read_sql(query, con=get_pgEngine())  
-    current_vessels_zone = df.to_dict(orient='records')   
+def sweep_open_visits():
+    """
+    Time out the open visits that no new fix will update: vessels silent for
+    STALE_SECONDS before the newest fix processed, closed at their last fix, and
+    TSS lane visits past TSS_TIMEOUT. Silence is measured from the last fix in
+    memory, the visit's own tsCurrent only stands in for a vessel without one
+    (after a restart or a partition takeover).
+    """
+    global last_sweep
 
-    del df
+    if time.monotonic() - last_sweep < SWEEP_INTERVAL or not open_visits.loaded:
+        return
+
+    last_sweep = time.monotonic()
+    stale = position_watermark.latest - timedelta(seconds=STALE_SECONDS)
+    last_fixes.prune(stale)
+    pending_transitions.prune(stale)
+    items_to_update = []
+    events = []
+
+    for visit in open_visits.visits.values():
+        last_seen, longitude, latitude = visit_last_seen(visit)
+
+        if last_seen < stale:
+            ts_out = last_seen
+        elif tss_timed_out(visit):
+            ts_out = datetime.now()
+        else:
+            continue
+
+        logging.info(f"[TIMEOUT] :: vessel {visit['mmsi']} swept from zone {visit['zone']}")
+        items_to_update.append({**visit, "tsOut": ts_out})
+        events.append(zone_event(ts_out, visit['mmsi'], visit['zone'], TIMEOUT, longitude, latitude))
+
+    write_transitions([], items_to_update, events)
+
+
+def run_cycle():
+    """One cycle with an in-process engine: new fixes through the zone state machine, then the sweep when due."""
+    logging.info(f'Fetching data....')
+    vessels_data, crossed, fixes = get_vessel_data()
+    upsert_ais_position(vessels_data, crossed)
+    position_watermark.advance(fixes)
+    last_fixes.advance(fixes)
+
+    sweep_open_visits()
+
+    del vessels_data
     gc.collect()
 
 
-    with Session(get_pgEngine()) as session:
-        logging.info(f'Loading data....{len(current_vessels_zone)}')
-
-        for cnt, i in enumerate(data):
-            # ais_position = Ais_Position(**i)   
-
-            for idx, zone in enumerate(zones):
-                rslt = duckdb.sql(f'''
-                    SELECT ST_Within(ST_Point({i['longitude']}, {i['latitude']}), ST_GeomFromGeoJSON({zone})) as within_area
-                ''').fetchall()       
-
-                in_zone = rslt[0][0] 
-                existing_vessel_zone = next(filter(lambda x: x["mmsi"] == i['mmsi'] and x["zone"] == idx and pd.isnull(x['tsOut']), current_vessels_zone), None)      
-
-                if in_zone:
-                    if existing_vessel_zone:
-                        logging.info(f"[UPDATE] :: vessel {i['mmsi']} in zone {existing_vessel_zone['zone']}")
-                        
-                        if pd.isnull(existing_vessel_zone['tsOut']): 
-                            if datetime.now() - existing_vessel_zone['tsDetected'] > timedelta(hours=6) and (existing_vessel_zone['zone'] == 10 or existing_vessel_zone['zone'] == 11):
-                                existing_vessel_zone['tsOut'] = datetime.now() 
-                            else:
-                                existing_vessel_zone['tsOut'] = None 
-                        
-                        payload = existing_vessel_zone.copy()      #.model_dump()
-
-                        payload["longitude"] = i['longitude']
-                        payload["latitude"] = i['latitude'] 
-                        payload["tsCurrent"] = i['ts']                                     
-                        items_to_update.append(payload)                         
-
-                    else:
-                        logging.info(f"[INSERT] :: vessel {i['mmsi']} entered zone {idx}")
-                        new_vessel_zone = {
-                            "tsDetected": i['ts'],
-                            "mmsi": i['mmsi'],
-                            "navStatus": i['navStatus'],
-                            "navStatusDesc": i['navStatusDesc'],
-                            "longitude": i['longitude'],
-                            "latitude": i['latitude'], 
-                            "tsCurrent": i['ts'],
-                            "tsOut": None,
-                            "zone": idx                       
-                        }
-
-                        items_to_insert.append(new_vessel_zone)
-                else:                    
-                    if existing_vessel_zone:
-                        logging.info(f"[UPDATE] :: vessel {i['mmsi']} exit zone {existing_vessel_zone['zone']}")
-                        payload = existing_vessel_zone      #.model_dump()
-
-                        payload["tsOut"] = i['ts']                 
-                        items_to_update.append(payload)                
-
-
-            if cnt % 300 == 0:
-                logging.info(f'Partially commiting to database....')
-                session.bulk_update_mappings(Ais_VesselInZone, items_to_update)
-                session.bulk_insert_mappings(Ais_VesselInZone, items_to_insert)
-                session.commit() 
-
-                items_to_update.clear()
-                items_to_update = []
-                items_to_insert.clear()
-                items_to_insert = []
-
-                logging.info(f'Partially upserting data done....')
-
-
-        logging.info(f'Commiting to database....')
-        if len(items_to_update) != 0: session.bulk_update_mappings(Ais_VesselInZone, items_to_update)
-        if len(items_to_insert) != 0: session.bulk_insert_mappings(Ais_VesselInZone, items_to_insert)
-        if len(items_to_update) != 0 or len(items_to_insert) != 0: session.commit() 
-
-        logging.info(f'Upserting data done....')
-        
-        del data
-        gc.collect()
-
-        return 0            
+def run_postgis_cycle():
+    """One cycle with ZONE_ENGINE=postgis: a single statement, then the sweep when due."""
+    global last_sweep
+
+    with get_pgEngine().begin() as conn:
+        row = zone_engine.cycle(conn, position_watermark.since(), CURRENT_UPDATE_SECONDS, partition_leases)
+
+    position_watermark.advance_to(row.max_updated, row.max_ts)
+
+    if time.monotonic() - last_sweep < SWEEP_INTERVAL:
+        return
+
+    last_sweep = time.monotonic()
+
+    with get_pgEngine().begin() as conn:
+        zone_engine.sweep(conn, position_watermark.latest - timedelta(seconds=STALE_SECONDS), datetime.now(), TSS_ZONES, datetime.now() - TSS_TIMEOUT, partition_leases)
+
+
+def claim_partitions():
+    """Refresh the partitions of this analyzer, False while it owns none."""
+    if partition_leases is None:
+        return True
+
+    if partition_leases.refresh():
+        # partitions taken over bring open visits and recent fixes this worker has not seen
+        open_visits.invalidate()
+        position_watermark.rewind(STALE_SECONDS)
+
+    return len(partition_leases.owned) > 0
 
 
 if __name__ == "__main__":
@@ -277,12 +552,15 @@ if __name__ == "__main__":
 
     while runFlg:
         try:
-            logging.info(f'Fetching data....')
-            vessels_data = get_vessel_data()
-            rslt = upsert_ais_position(vessels_data)
-
-            del vessels_data
-            gc.collect()
+            if not claim_partitions():
+                logging.info(f'No partition owned....')
+                time.sleep(5)
+                continue
+
+            if ZONE_ENGINE == 'postgis':
+                run_postgis_cycle()
+            else:
+                run_cycle()
 
         except KeyboardInterrupt:
             runFlg = False
@@ -0,0 +1,260 @@
+# Zone membership for a whole batch of positions
+#
+# Both engines parse the zone polygons once and answer membership(lon, lat) with a
+# vessel x zone boolean matrix for the whole batch:
+#   ZoneRegistry      : shapely prepared geometries in an STRtree, candidates are
+#                       pruned by bounding box before the exact test
+#   DuckDBZoneEngine  : one DuckDB spatial join against a zones table, kept in a
+#                       database file named after the zones and opened read-only
+#
+# ZoneRegistry also finds where the track segments between consecutive fixes
+# cross zone boundaries, so a zone passed through between two fixes is not missed.
+#
+# Zones given a buffer (metres) are also held shrunk and grown by it, and
+# hysteresis(lon, lat) answers against both in the same batch: a vessel enters
+# once inside the shrunk polygon and leaves once outside the grown one, so
+# positions jittering over the boundary do not flip its state.
+
+import os
+import hashlib
+import duckdb
+import shapely
+import numpy as np
+import pandas as pd
+
+
+# buffers are turned into degrees, close enough for a few hundred metres near the equator
+METRES_PER_DEGREE = 111320
+
+
+def buffer_degrees(buffers, count):
+    if buffers is None:
+        return np.zeros(count)
+
+    return np.asarray(buffers, dtype=np.float64) / METRES_PER_DEGREE
+
+
+def zone_geometries(zones, buffers=None):
+    """
+    (geoms, inner, outer) arrays of shapely geometries: the zones as given, shrunk
+    and grown by their buffer. Every engine takes its polygons from here.
+    """
+    buffers = buffer_degrees(buffers, len(zones))
+    geoms = np.array([shapely.geometry.shape(zone) for zone in zones], dtype=object)
+
+    # a strip narrower than twice its buffer keeps its own polygon to enter
+    inner = shapely.buffer(geoms, -buffers)
+    inner = np.where(shapely.is_empty(inner), geoms, inner)
+    outer = shapely.buffer(geoms, buffers)
+
+    return geoms, inner, outer
+
+
+def connect_duckdb(database=':memory:', extension=None, read_only=False):
+    """
+    DuckDB connection with the spatial extension loaded without network access,
+    from `extension` (a vendored spatial.duckdb_extension file) when given, else
+    from the local extension directory, filled when the image is built.
+    """
+    con = duckdb.connect(database, read_only=read_only, config={'autoinstall_known_extensions': False})
+    con.execute(f"LOAD '{extension}'" if extension else "LOAD spatial")
+
+    return con
+
+
+class ZoneRegistry:
+    def __init__(self, zones, buffers=None):
+        self.count = len(zones)
+        self.geoms, self.inner, self.outer = zone_geometries(zones, buffers)
+        self.bounds = shapely.bounds(self.geoms)
+
+        self.boundaries = shapely.boundary(self.geoms)
+
+        for geoms in (self.geoms, self.inner, self.outer):
+            shapely.prepare(geoms)
+
+        self.tree = shapely.STRtree(self.geoms)
+        self.inner_tree = shapely.STRtree(self.inner)
+        self.outer_tree = shapely.STRtree(self.outer)
+
+    def zones_containing(self, points):
+        """
+        (point index, zone index) pairs, one per zone containing a point, as a 2 x n
+        array. The tree only tests the zones whose bounding box holds the point.
+        """
+        return self.tree.query(points, predicate='within')
+
+    def membership(self, lon, lat):
+        """Boolean matrix, row per position and column per zone, True where the position lies within the zone."""
+        points = shapely.points(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        inside = np.zeros((len(points), self.count), dtype=bool)
+
+        if len(points) == 0:
+            return inside
+
+        idx, zone = self.zones_containing(points)
+        inside[idx, zone] = True
+
+        return inside
+
+    def hysteresis(self, lon, lat):
+        """
+        (deep, near) boolean matrices shaped like membership(): deep where the
+        position lies within the zone shrunk by its buffer, near where it lies
+        within the zone grown by it.
+        """
+        points = shapely.points(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        deep = np.zeros((len(points), self.count), dtype=bool)
+        near = np.zeros((len(points), self.count), dtype=bool)
+
+        if len(points) == 0:
+            return deep, near
+
+        idx, zone = self.inner_tree.query(points, predicate='within')
+        deep[idx, zone] = True
+
+        idx, zone = self.outer_tree.query(points, predicate='within')
+        near[idx, zone] = True
+
+        return deep, near
+
+    def crossings(self, lon0, lat0, lon1, lat1):
+        """
+        Boundary crossings of the segments (lon0, lat0) -> (lon1, lat1) as
+        (segment index, zone index, fraction along the segment) arrays, ordered by
+        segment, zone and fraction. A stretch running along a boundary counts once,
+        where it starts.
+        """
+        lon0, lat0, lon1, lat1 = (np.asarray(a, dtype=np.float64) for a in (lon0, lat0, lon1, lat1))
+        moved = np.flatnonzero((lon0 != lon1) | (lat0 != lat1))
+        none = (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64))
+
+        if len(moved) == 0:
+            return none
+
+        coords = np.stack([np.column_stack([lon0[moved], lat0[moved]]), np.column_stack([lon1[moved], lat1[moved]])], axis=1)
+        segments = shapely.linestrings(coords)
+
+        seg, zone = self.tree.query(segments, predicate='intersects')
+
+        if len(seg) == 0:
+            return none
+
+        parts, pair = shapely.get_parts(shapely.intersection(segments[seg], self.boundaries[zone]), return_index=True)
+
+        if len(parts) == 0:
+            return none
+
+        points = np.where(shapely.get_type_id(parts) == 0, parts, shapely.get_point(parts, 0))
+        fraction = shapely.line_locate_point(segments[seg[pair]], points, normalized=True)
+
+        seg, zone = moved[seg[pair]], zone[pair]
+        order = np.lexsort((fraction, zone, seg))
+
+        return seg[order], zone[order], fraction[order]
+
+
+class DuckDBZoneEngine:
+    def __init__(self, zones, buffers=None, database=':memory:', extension=None):
+        self.count = len(zones)
+
+        # (geom, geom_in, geom_out) WKB per zone; the database file is named after
+        # them, so a file found on disk always holds these zones
+        rows = list(zip(*(shapely.to_wkb(geoms) for geoms in zone_geometries(zones, buffers))))
+        fingerprint = hashlib.sha1(b''.join(wkb for row in rows for wkb in row)).hexdigest()
+
+        if database == ':memory:':
+            self.con = connect_duckdb(database, extension)
+            self.build(self.con, rows)
+        else:
+            self.con = self.open(database, extension, rows, fingerprint)
+
+    def open(self, database, extension, rows, fingerprint):
+        """
+        Read-only connection on the zones file of these geometries, e.g.
+        zones-<fingerprint>.duckdb for `database` zones.duckdb. A missing file is
+        built under a name of this process and renamed into place, so analyzers
+        running side by side never open a file being written; any number can
+        share it read-only.
+        """
+        root, ext = os.path.splitext(database)
+        path = f'{root}-{fingerprint[:12]}{ext or ".duckdb"}'
+
+        if not os.path.exists(path):
+            tmp = f'{path}.{os.getpid()}.tmp'
+
+            # a build of this process that died before its rename
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+            con = connect_duckdb(tmp, extension)
+
+            try:
+                self.build(con, rows)
+
+            finally:
+                con.close()
+
+            os.replace(tmp, path)
+
+        return connect_duckdb(path, extension, read_only=True)
+
+    def build(self, con, rows):
+        con.execute("BEGIN")
+        con.execute("CREATE TABLE zones (zone INTEGER, geom GEOMETRY, geom_in GEOMETRY, geom_out GEOMETRY)")
+        con.executemany(
+            "INSERT INTO zones VALUES (?, ST_GeomFromWKB(?), ST_GeomFromWKB(?), ST_GeomFromWKB(?))",
+            [(idx, *row) for idx, row in enumerate(rows)]
+        )
+
+        con.execute("CREATE INDEX zones_geom_idx ON zones USING RTREE (geom)")
+        con.execute("CREATE INDEX zones_geom_out_idx ON zones USING RTREE (geom_out)")
+        con.execute("COMMIT")
+
+    def join(self, lon, lat, within, select=''):
+        points = pd.DataFrame({"idx": np.arange(len(lon)), "lon": lon, "lat": lat})
+        self.con.register('points', points)
+
+        try:
+            return self.con.execute(f'''
+                SELECT p.idx, z.zone{select}
+                FROM points p
+                JOIN zones z ON ST_Within(ST_Point(p.lon, p.lat), z.{within})
+            ''').fetchnumpy()
+
+        finally:
+            self.con.unregister('points')
+
+    def membership(self, lon, lat):
+        """Boolean matrix, row per position and column per zone, True where the position lies within the zone."""
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        inside = np.zeros((len(lon), self.count), dtype=bool)
+
+        if len(lon) == 0:
+            return inside
+
+        hits = self.join(lon, lat, 'geom')
+        inside[hits['idx'], hits['zone']] = True
+
+        return inside
+
+    def hysteresis(self, lon, lat):
+        """(deep, near) matrices as ZoneRegistry.hysteresis(), from one join against the grown zones."""
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        deep = np.zeros((len(lon), self.count), dtype=bool)
+        near = np.zeros((len(lon), self.count), dtype=bool)
+
+        if len(lon) == 0:
+            return deep, near
+
+        hits = self.join(lon, lat, 'geom_out', ', ST_Within(ST_Point(p.lon, p.lat), z.geom_in) AS deep')
+        near[hits['idx'], hits['zone']] = True
+        deep[hits['idx'], hits['zone']] = hits['deep']
+
+        return deep, near
+
+    def crossings(self, lon0, lat0, lon1, lat1):
+        """Segment crossings are only found by ZoneRegistry, this engine tests the fixes alone."""
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
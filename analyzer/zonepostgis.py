@@ -0,0 +1,183 @@
+# Zone membership and transitions computed inside PostgreSQL (ZONE_ENGINE=postgis)
+#
+# The zones live in ais_zone with GiST indexes, with the shrunk / grown polygons
+# of zone_geometries() like the in-process engines, and the prefilter region in
+# ais_zone_region. A cycle is one statement: the latest positions past the
+# watermark within the region (or of vessels with an open visit) are joined with the zones, visits are opened (ENTER) and
+# closed (EXIT) in ais_vesselinzone, positions of vessels still inside are
+# written back at most every CURRENT_UPDATE_SECONDS, and the transitions are
+# appended to ais_zoneevent. Nothing but counts comes back to Python.
+#
+# Replaying a position is harmless (an open visit is not opened twice, a closed
+# one not closed twice), so the watermark overlap needs no per vessel state.
+# Track segment crossings and dwell are not evaluated in this mode; timeouts
+# are left to sweep().
+
+from sqlalchemy import text
+
+import shapely
+import logging
+
+from zoneengine import zone_geometries
+from zoneshard import SHARD_FILTER
+
+
+cycle_query = '''
+    WITH l AS (
+        SELECT mmsi, ts, "navStatus", "navStatusDesc", longitude, latitude,
+            updated, ST_SetSRID(ST_MakePoint(longitude, latitude), 4326) AS pt
+        FROM public.ais_position_latest
+        WHERE latitude >= -90 AND latitude <= 90 AND updated >= :updated_min {shard}
+    ),
+    -- the region prefilter of the in-process engines, vessels with an open visit
+    -- are kept wherever they are so they can exit
+    p AS (
+        SELECT l.*
+        FROM l
+        WHERE {region}
+    ),
+    o AS (
+        SELECT v.id, v.mmsi, v.zone, v."tsCurrent"
+        FROM public.ais_vesselinzone v
+        JOIN p ON p.mmsi = v.mmsi
+        WHERE v."tsOut" IS NULL
+    ),
+    -- memberships after this cycle: open visits stay while near, new ones need deep
+    m AS (
+        SELECT p.*, z.zone, o.id, o."tsCurrent"
+        FROM p
+        JOIN public.ais_zone z ON ST_Within(p.pt, z.geom_out)
+        LEFT JOIN o ON o.mmsi = p.mmsi AND o.zone = z.zone
+        WHERE o.id IS NOT NULL OR ST_Within(p.pt, z.geom_in)
+    ),
+    entered AS (
+        INSERT INTO public.ais_vesselinzone ("tsDetected", mmsi, "navStatus", "navStatusDesc", longitude, latitude, "tsCurrent", "tsOut", zone)
+        SELECT ts, mmsi, "navStatus", "navStatusDesc", longitude, latitude, ts, NULL, zone
+        FROM m
+        WHERE id IS NULL
+        RETURNING mmsi, zone, "tsDetected" AS ts, longitude, latitude
+    ),
+    exited AS (
+        UPDATE public.ais_vesselinzone v
+        SET "tsOut" = p.ts
+        FROM o
+        JOIN p ON p.mmsi = o.mmsi
+        WHERE v.id = o.id AND NOT EXISTS (SELECT 1 FROM m WHERE m.id = o.id)
+        RETURNING v.mmsi, v.zone, p.ts, p.longitude, p.latitude
+    ),
+    moved AS (
+        UPDATE public.ais_vesselinzone v
+        SET longitude = m.longitude, latitude = m.latitude, "tsCurrent" = m.ts
+        FROM m
+        WHERE v.id = m.id AND :current >= 0
+            AND (m."tsCurrent" IS NULL OR m.ts >= m."tsCurrent" + make_interval(secs => :current))
+        RETURNING v.id
+    ),
+    logged AS (
+        INSERT INTO public.ais_zoneevent (ts, mmsi, zone, event, longitude, latitude)
+        SELECT ts, mmsi, zone, 'ENTER', longitude, latitude FROM entered
+        UNION ALL
+        SELECT ts, mmsi, zone, 'EXIT', longitude, latitude FROM exited
+    )
+    SELECT (SELECT count(*) FROM p) AS positions,
+        (SELECT max(ts) FROM l) AS max_ts,
+        (SELECT max(updated) FROM l) AS max_updated,
+        (SELECT count(*) FROM entered) AS entered,
+        (SELECT count(*) FROM exited) AS exited,
+        (SELECT count(*) FROM moved) AS moved
+'''
+
+region_filter = '''EXISTS (SELECT 1 FROM public.ais_zone_region r WHERE ST_Within(l.pt, r.geom))
+            OR EXISTS (SELECT 1 FROM public.ais_vesselinzone v WHERE v.mmsi = l.mmsi AND v."tsOut" IS NULL)'''
+
+sweep_query = '''
+    -- last seen: the vessel's latest position, tsCurrent is not written back when
+    -- CURRENT_UPDATE_SECONDS is None
+    WITH s AS (
+        SELECT o.id, GREATEST(COALESCE(o."tsCurrent", o."tsDetected"), l.ts) AS ts
+        FROM (SELECT * FROM public.ais_vesselinzone WHERE "tsOut" IS NULL {shard}) o
+        LEFT JOIN public.ais_position_latest l ON l.mmsi = o.mmsi
+    ),
+    closed AS (
+        UPDATE public.ais_vesselinzone v
+        SET "tsOut" = CASE WHEN s.ts < :stale THEN s.ts ELSE :now END
+        FROM s
+        WHERE v.id = s.id
+            AND (s.ts < :stale OR (v.zone = ANY(:tss_zones) AND v."tsDetected" < :tss_before))
+        RETURNING v.mmsi, v.zone, v."tsOut" AS ts, v.longitude, v.latitude
+    )
+    INSERT INTO public.ais_zoneevent (ts, mmsi, zone, event, longitude, latitude)
+    SELECT ts, mmsi, zone, 'TIMEOUT', longitude, latitude FROM closed
+'''
+
+
+class PostGISZoneEngine:
+    def __init__(self, zones, buffers=None, region=None):
+        # (geom, geom_in, geom_out) WKB per zone, built like the in-process engines
+        self.rows = list(zip(*(shapely.to_wkb(geoms) for geoms in zone_geometries(zones, buffers))))
+
+        # positions outside `region` (a GeoJSON polygon) are left out, None keeps them all
+        self.region = shapely.to_wkb(shapely.geometry.shape(region)) if region is not None else None
+
+    def create_zone_table(self, conn):
+        """(Re)load the zones into ais_zone, on startup, so polygons edited in polygons.py are picked up."""
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS postgis'))
+        conn.execute(text('''
+            CREATE TABLE IF NOT EXISTS ais_zone (
+                zone INTEGER PRIMARY KEY,
+                geom geometry(Polygon, 4326),
+                geom_in geometry(Geometry, 4326),
+                geom_out geometry(Geometry, 4326)
+            )
+        '''))
+        conn.execute(text('''
+            CREATE TABLE IF NOT EXISTS ais_zone_region (
+                region INTEGER PRIMARY KEY,
+                geom geometry(Geometry, 4326)
+            )
+        '''))
+
+        for idx, (geom, geom_in, geom_out) in enumerate(self.rows):
+            conn.execute(text('''
+                INSERT INTO ais_zone (zone, geom, geom_in, geom_out)
+                VALUES (:zone, ST_GeomFromWKB(:geom, 4326), ST_GeomFromWKB(:geom_in, 4326), ST_GeomFromWKB(:geom_out, 4326))
+                ON CONFLICT (zone) DO UPDATE SET geom = EXCLUDED.geom, geom_in = EXCLUDED.geom_in, geom_out = EXCLUDED.geom_out
+            '''), {"zone": idx, "geom": geom, "geom_in": geom_in, "geom_out": geom_out})
+
+        conn.execute(text('DELETE FROM ais_zone WHERE zone >= :count'), {"count": len(self.rows)})
+        conn.execute(text('DELETE FROM ais_zone_region'))
+
+        if self.region is not None:
+            conn.execute(text('INSERT INTO ais_zone_region (region, geom) VALUES (0, ST_GeomFromWKB(:geom, 4326))'), {"geom": self.region})
+
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_ais_zone_geom_in ON ais_zone USING gist (geom_in)'))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_ais_zone_geom_out ON ais_zone USING gist (geom_out)'))
+        conn.execute(text('ANALYZE ais_zone'))
+        conn.execute(text('ANALYZE ais_zone_region'))
+
+    def cycle(self, conn, updated_min, current, leases=None):
+        """
+        Run one cycle over the positions written from `updated_min`, returns
+        (positions, latest ts, latest write time, entered, exited, moved).
+        """
+        shard = f'AND {SHARD_FILTER}' if leases else ''
+        params = {"updated_min": updated_min, "current": -1 if current is None else current, **(leases.params() if leases else {})}
+
+        region = region_filter if self.region is not None else 'true'
+
+        row = conn.execute(text(cycle_query.format(shard=shard, region=region)), params).one()
+        logging.info(f'PostGIS cycle....{row.positions} positions, {row.entered} entered, {row.exited} exited, {row.moved} moved')
+
+        return row
+
+    def sweep(self, conn, stale, now, tss_zones, tss_before, leases=None):
+        """Time out visits without a fix since `stale` (closed at their last fix) and TSS visits detected before `tss_before`."""
+        shard = f'AND {SHARD_FILTER}' if leases else ''
+        params = {"stale": stale, "now": now, "tss_zones": list(tss_zones), "tss_before": tss_before, **(leases.params() if leases else {})}
+
+        rows = conn.execute(text(sweep_query.format(shard=shard)), params).rowcount
+
+        if rows:
+            logging.info(f'PostGIS sweep....{rows} visits timed out')
+
+        return rows
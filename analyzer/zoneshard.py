@@ -0,0 +1,86 @@
+# Partitions of the fleet (mmsi % count) owned by this analyzer worker
+#
+# Ownership is a session level PostgreSQL advisory lock per partition, held on a
+# connection of its own: the locks go away with the connection, so the
+# partitions of a dead worker are free again as soon as PG drops its session.
+# Every worker also holds one shared lock, whose holders are the live workers;
+# each takes up to ceil(count / workers) partitions and gives back what it holds
+# above that when a worker joins, so the split rebalances by itself.
+
+import math
+import logging
+import psycopg2
+
+
+# advisory lock keys: (PARTITION_LOCK, partition) and (MEMBER_LOCK, 0)
+PARTITION_LOCK = 71801
+MEMBER_LOCK = 71802
+
+
+class PartitionLeases:
+    def __init__(self, connect, count):
+        self.connect = connect
+        self.count = count
+        self.owned = set()
+        self.conn = None
+
+    def execute(self, sql, params=None):
+        with self.conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchone()[0]
+
+    def refresh(self):
+        """Join, take or give back partitions; True when the owned set changed."""
+        before = set(self.owned)
+
+        try:
+            if self.conn is None:
+                self.conn = self.connect()
+                self.conn.autocommit = True
+                self.execute('SELECT pg_advisory_lock_shared(%s, 0)', (MEMBER_LOCK,))
+
+            workers = self.execute('''
+                SELECT count(*) FROM pg_locks
+                WHERE locktype = 'advisory' AND classid = %s AND objid = 0 AND objsubid = 2 AND granted
+            ''', (MEMBER_LOCK,))
+
+            share = math.ceil(self.count / max(workers, 1))
+
+            for partition in sorted(self.owned, reverse=True)[:max(len(self.owned) - share, 0)]:
+                self.execute('SELECT pg_advisory_unlock(%s, %s)', (PARTITION_LOCK, partition))
+                self.owned.discard(partition)
+
+            for partition in range(self.count):
+                if len(self.owned) >= share:
+                    break
+
+                if partition not in self.owned and self.execute('SELECT pg_try_advisory_lock(%s, %s)', (PARTITION_LOCK, partition)):
+                    self.owned.add(partition)
+
+        # a lost session lost its locks too, start over on the next refresh
+        except psycopg2.Error as e:
+            logging.info(f'Partition leases lost :: {e}')
+            self.close()
+
+        if self.owned != before:
+            logging.info(f'Partitions owned....{sorted(self.owned)} of {self.count}')
+
+        return self.owned != before
+
+    def params(self):
+        return {"partition_count": self.count, "partitions": sorted(self.owned)}
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+
+            except psycopg2.Error:
+                pass
+
+        self.conn = None
+        self.owned = set()
+
+
+# SQL condition restricting a query on a table with an mmsi column to the owned partitions
+SHARD_FILTER = 'mod(mmsi, :partition_count) = ANY(:partitions)'
@@ -0,0 +1,203 @@
+# Analyzer state kept in memory between cycles
+#
+# OpenVisitIndex    : open visits of ais_vesselinzone ("tsOut" IS NULL), read once
+#                     and held in a dict keyed by (mmsi, zone). Each cycle applies
+#                     what it committed: closed visits are removed, updated ones
+#                     replaced, and the visits it inserted are read back by id,
+#                     since the insert does not return them. Any failure drops the
+#                     index so the next cycle starts again from the table.
+# PositionWatermark : which latest positions are new since the previous cycle
+# LastFixIndex      : previous fix of each vessel, where its next track segment starts
+# PendingTransitions: ENTER / EXIT held back until they outlast their zone's dwell
+# zone_transition   : the event a fix causes for one vessel and zone
+
+from datetime import timedelta
+
+from sqlalchemy import text
+
+import logging
+import pandas as pd
+
+from zoneshard import SHARD_FILTER
+
+
+ENTER = 'ENTER'
+EXIT = 'EXIT'
+TIMEOUT = 'TIMEOUT'
+
+
+def zone_transition(visit, in_zone, timed_out):
+    """
+    ENTER, EXIT, TIMEOUT or None for a fix, given the open visit of the vessel in
+    the zone (None when outside), whether the fix lies in the zone and whether the
+    open visit outlived its zone's limit.
+    """
+    if visit is None:
+        return ENTER if in_zone else None
+
+    if not in_zone:
+        return EXIT
+
+    return TIMEOUT if timed_out else None
+
+
+class OpenVisitIndex:
+    def __init__(self, leases=None):
+        # with PartitionLeases, only the visits of the partitions owned are held
+        self.leases = leases
+        self.visits = {}
+        self.last_id = 0
+        self.loaded = False
+
+    def add(self, rows):
+        # rows come oldest first, the most recent open visit of a (mmsi, zone) wins
+        for visit in rows:
+            self.visits[(visit['mmsi'], visit['zone'])] = visit
+            self.last_id = max(self.last_id, visit['id'])
+
+    def read(self, conn, min_id=0):
+        shard = f'AND {SHARD_FILTER}' if self.leases else ''
+        params = {"min_id": min_id, **(self.leases.params() if self.leases else {})}
+
+        query = text(f"""
+            SELECT *
+            FROM public.ais_vesselinzone
+            WHERE "tsOut" IS NULL AND id > :min_id {shard}
+            ORDER BY "tsDetected", id
+        """)
+
+        return pd.read_sql(query, con=conn, params=params).to_dict(orient='records')
+
+    def load(self, conn):
+        self.visits.clear()
+        self.last_id = 0
+        self.add(self.read(conn))
+        self.loaded = True
+
+        logging.info(f'Open visits loaded....{len(self.visits)}')
+
+    def get(self, mmsi, zone):
+        return self.visits.get((mmsi, zone))
+
+    def apply(self, conn, updated):
+        """Bring the index in line with a committed cycle: `updated` visits and whatever was inserted since."""
+        for visit in updated:
+            key = (visit['mmsi'], visit['zone'])
+
+            if pd.isnull(visit['tsOut']):
+                self.visits[key] = visit
+            else:
+                self.visits.pop(key, None)
+
+        self.add(self.read(conn, self.last_id))
+
+    def invalidate(self):
+        self.visits.clear()
+        self.loaded = False
+
+
+class PositionWatermark:
+    """
+    Delta reads of the latest-position table on its write time (updated): rows
+    written past the watermark, re-reading `overlap` seconds behind it so rows
+    of a transaction that committed late are still seen. Not the message ts, as
+    the class A and B writers commit on their own and either may lag by hours.
+
+    Fixes already processed are recognised by the ts stored per mmsi, kept while
+    their row is within the overlap. `latest` is the newest fix ts processed,
+    where the silence of a vessel is measured from.
+    """
+
+    def __init__(self, initial, overlap):
+        self.watermark = initial
+        self.overlap = timedelta(seconds=overlap)
+        self.latest = initial
+        self.last_fix = {}
+        self.written = {}
+        self.started = False
+
+    def since(self):
+        return self.watermark - self.overlap if self.started else self.watermark
+
+    def new_fixes(self, df):
+        # NaT where the vessel has no fix processed, also when none has any
+        seen = pd.to_datetime(df['mmsi'].map(self.last_fix))
+        return df[seen.isna() | (df['ts'] > seen)].reset_index(drop=True)
+
+    def rewind(self, seconds):
+        """Read `seconds` further back on the next cycle, e.g. for partitions just taken over from another worker."""
+        self.watermark -= timedelta(seconds=seconds)
+
+    def advance(self, df):
+        """Mark the fixes of `df` (mmsi, ts, updated) processed, once the cycle using them is committed."""
+        if len(df) == 0:
+            self.advance_to(None)
+            return
+
+        self.last_fix.update(zip(df['mmsi'], df['ts']))
+        self.written.update(zip(df['mmsi'], df['updated']))
+        self.advance_to(df['updated'].max(), df['ts'].max())
+
+    def advance_to(self, updated, ts=None):
+        """Move the watermark up to the write time `updated` and `latest` up to `ts`, None leaves them."""
+        if updated is not None and not pd.isnull(updated):
+            self.watermark = max(self.watermark, pd.Timestamp(updated).to_pydatetime())
+
+        if ts is not None and not pd.isnull(ts):
+            self.latest = max(self.latest, pd.Timestamp(ts).to_pydatetime())
+
+        self.started = True
+        cutoff = self.since()
+        self.written = {mmsi: updated for mmsi, updated in self.written.items() if updated > cutoff}
+        self.last_fix = {mmsi: self.last_fix[mmsi] for mmsi in self.written}
+
+
+class LastFixIndex:
+    """Last processed fix per mmsi as (ts, longitude, latitude), segments spanning more than `max_gap` seconds are not used."""
+
+    def __init__(self, max_gap):
+        self.max_gap = timedelta(seconds=max_gap)
+        self.fixes = {}
+
+    def starts(self, data):
+        """Segment start of each record of `data`, None when the vessel has no recent previous fix."""
+        starts = []
+
+        for i in data:
+            start = self.fixes.get(i['mmsi'])
+            starts.append(start if start is not None and start[0] < i['ts'] <= start[0] + self.max_gap else None)
+
+        return starts
+
+    def advance(self, df):
+        self.fixes.update(zip(df['mmsi'], zip(df['ts'], df['longitude'], df['latitude'])))
+
+    def prune(self, before):
+        self.fixes = {mmsi: fix for mmsi, fix in self.fixes.items() if fix[0] >= before}
+
+
+class PendingTransitions:
+    def __init__(self):
+        self.pending = {}
+
+    def hold(self, key, event, at, ts, dwell):
+        """
+        Where (ts, longitude, latitude) the `event` of `key` started once it has held
+        for `dwell` seconds up to the fix at `ts`, None while it has not.
+        """
+        pending = self.pending.get(key)
+
+        if pending is None or pending[0] != event:
+            pending = self.pending[key] = (event, at)
+
+        if (ts - pending[1][0]).total_seconds() < dwell:
+            return None
+
+        del self.pending[key]
+        return pending[1]
+
+    def clear(self, key):
+        self.pending.pop(key, None)
+
+    def prune(self, before):
+        self.pending = {key: pending for key, pending in self.pending.items() if pending[1][0] >= before}
@@ -9,6 +9,7 @@ import time
 import math
 import gc
 import pydeck as pdk
+import numpy as np
 import pandas as pd
 import psycopg2
 
@@ -25,6 +26,7 @@ from sqlalchemy import and_, or_, desc, text
 from pydeck.types import String
 
 from polygons import *
+from vesselcache import VesselRegistryCache
 
 
 # Database URL (adjust username, password, host, port, database name)
@@ -78,6 +80,12 @@ def get_pgConn():
 
     return conn
 
+@st.cache_resource
+def get_vessel_cache():
+    # kept across reruns, reloaded from vessel_registry every few minutes
+    return VesselRegistryCache(get_pgEngine())
+
+
 def create_db_and_tables():   
     SQLModel.metadata.create_all(get_pgEngine(), checkfirst=True)
 
@@ -206,7 +214,7 @@ def gen_qry_vessel_zone_static():
                                 ELSE s."shipTypeDesc"
                             END AS "ShipType"
                         FROM public.ais_vesselinzone vz
-                        LEFT JOIN public.ais_static s on s.mmsi = vz.mmsi
+                        LEFT JOIN public.vessel_registry s on s.mmsi = vz.mmsi
                         WHERE vz.zone = {(opt_tss.index(tss)) + 10} AND vz."tsOut" IS NULL AND vz.mmsi IN (
                             {sub_qry}
                         )
@@ -246,17 +254,8 @@ def get_ais_position_data():
     #     results = session.exec(statement).all()
 
     query = text("""
-        SELECT p.*, s."shipType", s."shipTypeDesc", s."shipName", s."callsign", s."imo",
-			CASE
-				WHEN s."shipType" >= 40 AND s."shipType" < 50 THEN 'hs_craft'
-				WHEN s."shipType" >= 50 AND s."shipType" < 60 THEN 'tug'
-				WHEN s."shipType" >= 60 AND s."shipType" < 70 THEN 'passenger'
-				WHEN s."shipType" >= 70 AND s."shipType" < 80 THEN 'cargo'
-				WHEN s."shipType" >= 80 AND s."shipType" < 90 THEN 'tanker'
-				ELSE 'others'
-			END AS "shipcatagory"
-        FROM public.ais_position p
-        LEFT JOIN public.ais_static s on s.mmsi = p.mmsi
+        SELECT p.*
+        FROM public.ais_position_latest p
         WHERE p.latitude >= :lat_min AND p.latitude <= :lat_max AND p.ts >= :ts_min
         ORDER BY p."ts"
     """)
@@ -266,6 +265,22 @@ def get_ais_position_data():
 
     df = pd.read_sql(query, con=get_pgEngine(), params=params)  
 
+    # static data (class A, class B, Lloyd's) from the in-process registry instead of a join
+    df = get_vessel_cache().enrich(df)
+
+    ship_type = pd.to_numeric(df["shipType"], errors='coerce')
+    df["shipcatagory"] = np.select(
+        [
+            (ship_type >= 40) & (ship_type < 50),
+            (ship_type >= 50) & (ship_type < 60),
+            (ship_type >= 60) & (ship_type < 70),
+            (ship_type >= 70) & (ship_type < 80),
+            (ship_type >= 80) & (ship_type < 90)
+        ],
+        ['hs_craft', 'tug', 'passenger', 'cargo', 'tanker'],
+        default='others'
+    )
+
     category_color_map = {
         "hs_craft": [253, 119, 3, 200],         # orange
         "tug": [253, 248, 3, 200],              # yellow
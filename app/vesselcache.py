@@ -0,0 +1,79 @@
+# Process-local copy of vessel_registry
+#
+# The registry is held as one array per column, sorted by mmsi, and looked up with
+# np.searchsorted, so enriching a whole batch of positions is a handful of array
+# operations instead of a SQL join. The whole copy is reloaded once it is older
+# than `ttl` seconds; the registry itself only changes every few minutes.
+
+from sqlalchemy import text
+
+import time
+import threading
+import numpy as np
+import pandas as pd
+
+
+class VesselRegistryCache:
+    """
+    Shared by every Streamlit session thread: the arrays are published as one
+    (mmsi, values) tuple, so a reader always sees a consistent snapshot, and one
+    thread at a time reloads them.
+    """
+
+    columns = ['shipName', 'callsign', 'imo', 'shipType', 'shipTypeDesc', 'aisClass', 'flagName', 'destination']
+
+    def __init__(self, engine, ttl=300):
+        self.engine = engine
+        self.ttl = ttl
+        self.loaded = 0
+        self.data = (np.empty(0, dtype=np.int64), {})
+        self.lock = threading.Lock()
+
+    def load(self):
+        cols = ', '.join(f'"{c}"' for c in self.columns)
+
+        with self.engine.connect() as conn:
+            df = pd.read_sql(text(f'SELECT mmsi, {cols} FROM public.vessel_registry ORDER BY mmsi'), con=conn)
+
+        mmsi = df['mmsi'].to_numpy(dtype=np.int64)
+        values = {c: df[c].to_numpy() for c in self.columns}
+
+        self.data = (mmsi, values)
+        self.loaded = time.monotonic()
+
+    def refresh(self):
+        """Current (mmsi, values) snapshot, reloaded first when older than ttl."""
+        if time.monotonic() - self.loaded > self.ttl:
+            with self.lock:
+                # another session may have reloaded while this one waited
+                if time.monotonic() - self.loaded > self.ttl:
+                    self.load()
+
+        return self.data
+
+    def lookup(self, mmsi, data=None):
+        """Positions of `mmsi` in the snapshot `data` (the current one by default) and a mask of the ones found."""
+        keys, _ = data if data is not None else self.refresh()
+
+        mmsi = np.asarray(mmsi, dtype=np.int64)
+        idx = np.searchsorted(keys, mmsi)
+        idx = np.minimum(idx, max(len(keys) - 1, 0))
+        found = (keys[idx] == mmsi) if len(keys) > 0 else np.zeros(len(mmsi), dtype=bool)
+
+        return idx, found
+
+    def enrich(self, df):
+        """Add the registry columns to a DataFrame with an mmsi column, None where unknown."""
+        data = self.refresh()
+        keys, columns = data
+        idx, found = self.lookup(df['mmsi'].to_numpy(), data)
+
+        for c in self.columns:
+            values = np.full(len(df), None, dtype=object)
+
+            if len(keys) > 0:
+                values[found] = columns[c][idx[found]]
+
+            df[c] = values
+
+        return df